@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Beamforming codebooks and the codebook (beam) search shared by main_fc_tf.py
+and main_xgboost.py.
+"""
+
+import math
+import hashlib
+import numpy as np
+
+block_size = 4096 # users per matrix product in the batched beam search
+
+_dft_codebooks = {} # is_dft_codebook of every codebook searched so far
+
+def compute_optimal_gains(H, F, block_size=block_size, My=None, Mz=None, k_oversampling=1, precision='double', last_codeword=True):
+    # Batched codebook search over the users (rows of H) and codewords
+    # (columns of F).  The gains of a block of users are one matrix product,
+    # so memory is bounded by block_size x codewords.
+    # By default returns |h^H f|^2 of the last codeword, which is what the
+    # per-user loop of the original scripts returned (see
+    # compute_optimal_gain_bf_vector); last_codeword=False returns the best
+    # gain max_k |h^H f_k|^2 instead.
+    # Given the array size (My, Mz), a codebook that is
+    # compute_dft_codebook(My, Mz, k_oversampling) is searched with FFTs.
+    # precision='single' runs in complex64 and returns float32 gains.
+    dtype = _complex_dtype(precision)
+
+    if last_codeword:
+        F = F.astype(dtype)[:,-1:]
+    elif _is_dft(F, My, Mz, k_oversampling):
+        return compute_optimal_gains_fft(H, My, Mz, k_oversampling, block_size=block_size, precision=precision)
+    else:
+        F = F.astype(dtype)
+
+    n = H.shape[0]
+    gains = np.empty(n, dtype=F.real.dtype)
+
+    for start in np.arange(0, n, block_size):
+        stop = min(start + block_size, n)
+        gains[start:stop] = _gain_matrix(H[start:stop,:].astype(dtype), F).max(axis=1)
+
+    return gains
+
+def compute_optimal_gains_fft(H, My, Mz, k_oversampling=1, block_size=block_size, precision='double'):
+    # Same search for F = compute_dft_codebook(My, Mz, k_oversampling).
+    # Each channel reshaped to (Mz, My) is zero-padded to the oversampled
+    # grid; its 2-D FFT is h^H f for every codeword, in O(M log M).
+    dtype = _complex_dtype(precision)
+
+    n = H.shape[0]
+    gains = np.empty(n, dtype=np.empty(0, dtype=dtype).real.dtype)
+
+    for start in np.arange(0, n, block_size):
+        stop = min(start + block_size, n)
+        gains[start:stop] = _gain_matrix_fft(H[start:stop,:].astype(dtype), My, Mz, k_oversampling).max(axis=1)
+
+    return gains
+
+def compute_optimal_beams(H, F, top_k=1, block_size=block_size, My=None, Mz=None, k_oversampling=1, precision='double', last_codeword=True):
+    # Same search as compute_optimal_gains, but also keeps which codewords won.
+    # Returns (gains, top_beams, top_gains): gains as compute_optimal_gains
+    # with the same last_codeword, and top_beams the column indices in F of
+    # the top_k codewords of every user by decreasing gain, so top_beams[:,0]
+    # is the argmax beam.  With last_codeword=False, gains == top_gains[:,0].
+    # top_beams is int16 (int32 for codebooks over 32768 beams), top_gains float32.
+    dtype = _complex_dtype(precision)
+    fft = _is_dft(F, My, Mz, k_oversampling)
+    F = F.astype(dtype)
+
+    n, n_beams = H.shape[0], F.shape[1]
+    top_k = min(top_k, n_beams)
+    gains = np.empty(n, dtype=F.real.dtype)
+    top_beams = np.empty((n, top_k), dtype=beam_index_dtype(n_beams))
+    top_gains = np.empty((n, top_k), dtype=np.float32)
+
+    for start in np.arange(0, n, block_size):
+        stop = min(start + block_size, n)
+        h = H[start:stop,:].astype(dtype)
+        G = _gain_matrix_fft(h, My, Mz, k_oversampling) if fft else _gain_matrix(h, F)
+        if last_codeword:
+            gains[start:stop] = G[:,-1]
+
+        # Partition out the top_k codewords, then sort only those
+        beams = np.argpartition(G, n_beams - top_k, axis=1)[:, n_beams - top_k:]
+        order = np.argsort(-np.take_along_axis(G, beams, axis=1), axis=1, kind='stable')
+        beams = np.take_along_axis(beams, order, axis=1)
+        G = np.take_along_axis(G, beams, axis=1)
+
+        if not last_codeword:
+            gains[start:stop] = G[:,0]
+        top_beams[start:stop,:] = beams
+        top_gains[start:stop,:] = G
+
+    return gains, top_beams, top_gains
+
+def beam_index_dtype(n_beams):
+    return np.int16 if n_beams <= np.iinfo(np.int16).max + 1 else np.int32
+
+def _gain_matrix(h, F):
+    # |h_i^H f_j|^2 for every user i of the block and every codeword j.
+    return np.abs(np.conj(h) @ F) ** 2
+
+def _gain_matrix_fft(h, My, Mz, k_oversampling):
+    # Same for the DFT codebook; the codeword index is the flattened (z, y)
+    # frequency index, which is the column order of kron(Fz, Fy).
+    G = np.abs(np.fft.fft2(h.reshape(-1, Mz, My), s=(k_oversampling*Mz, k_oversampling*My))) ** 2 / (My * Mz)
+
+    return G.reshape(h.shape[0], -1)
+
+def _is_dft(F, My, Mz, k_oversampling):
+    # is_dft_codebook, checked once per codebook: the check builds the dense
+    # DFT codebook, which costs more than searching a block of users.
+    if My is None or Mz is None:
+        return False
+
+    key = (My, Mz, k_oversampling, F.shape, hashlib.sha1(np.ascontiguousarray(F).tobytes()).hexdigest())
+    if key not in _dft_codebooks:
+        _dft_codebooks[key] = is_dft_codebook(F, My, Mz, k_oversampling)
+
+    return _dft_codebooks[key]
+
+def _complex_dtype(precision):
+    if precision == 'single':
+        return np.complex64
+    if precision == 'double':
+        return np.complex128
+
+    raise ValueError('Unknown precision {}; use single or double.'.format(precision))
+
+def precision_report(H, F, My=None, Mz=None, k_oversampling=1, block_size=block_size, last_codeword=True):
+    # Max and mean absolute error in dB of the single-precision gains
+    # against the double-precision ones over the users of H.
+    single = compute_optimal_gains(H, F, block_size, My, Mz, k_oversampling, precision='single', last_codeword=last_codeword)
+    double = compute_optimal_gains(H, F, block_size, My, Mz, k_oversampling, precision='double', last_codeword=last_codeword)
+
+    error = np.abs(10*np.log10(single.astype(float)) - 10*np.log10(double))
+
+    return {'users': len(error), 'max_dB_error': float(np.max(error)), 'mean_dB_error': float(np.mean(error))}
+
+def compute_optimal_gain_bf_vector(h, F, last_codeword=True):
+    # Single-user reference of compute_optimal_gains.  The original scripts
+    # tracked max_gain but returned the gain of the last codeword, which is
+    # the default; last_codeword=False returns max_gain.
+    M, MK = F.shape
+
+    max_gain = 0
+
+    for code_index in np.arange(MK):
+        f_i = F[:,code_index]
+        channel_gain = abs(np.vdot(h, f_i)) ** 2
+        if (channel_gain > max_gain):
+            max_gain = channel_gain
+
+    if last_codeword:
+        return channel_gain
+
+    return max_gain
+
+def compute_bf_codebook(My, Mz, f_c, k_oversampling=1):
+    Fy = _compute_ula_codebook(My, f_c, k_oversampling) # F is M rows by Mk columns, where M corresponds to the antennas in the horizontal direction
+    Fz = _compute_ula_codebook(Mz, f_c, k_oversampling)
+
+    F = np.kron(Fz, Fy)
+
+    return F
+
+def compute_wide_codebook(My, Mz, f_c, My_coarse, Mz_coarse):
+    # Wide beams for the first stage of the hierarchical search: the
+    # codebook of a My_coarse x Mz_coarse sub-array, zero on the other
+    # antennas, so every beam is My/My_coarse x Mz/Mz_coarse times wider.
+    Fy = np.zeros([My, My_coarse], dtype=complex)
+    Fy[:My_coarse,:] = _compute_ula_codebook(My_coarse, f_c)
+    Fz = np.zeros([Mz, Mz_coarse], dtype=complex)
+    Fz[:Mz_coarse,:] = _compute_ula_codebook(Mz_coarse, f_c)
+
+    F = np.kron(Fz, Fy)
+
+    return F
+
+def compute_hierarchical_beams(H, My, Mz, f_c, k_oversampling=2, My_coarse=None, Mz_coarse=None, n_candidates=1, block_size=block_size, precision='double', report=False):
+    # Two-stage beam search: every user probes all the wide beams of
+    # compute_wide_codebook, then the oversampled codewords of
+    # compute_bf_codebook(My, Mz, f_c, k_oversampling) that fall within its
+    # n_candidates best wide beams.  A wide beam at angle index (m_z, m_y)
+    # covers the k*My/My_coarse x k*Mz/Mz_coarse fine beams centered on it.
+    # Returns (gains, beams, probes, gap_dB): the gain and index in F of the
+    # best probed codeword and the number of distinct beams probed, per user.
+    # gap_dB, the loss against the exhaustive search over F, is only
+    # computed with report=True, since that runs the exhaustive search too;
+    # it is None otherwise.  Users whose channel is all zero lose nothing.
+    My_coarse = My_coarse or max(1, My // 8)
+    Mz_coarse = Mz_coarse or Mz
+    if (k_oversampling * My) % My_coarse != 0 or (k_oversampling * Mz) % Mz_coarse != 0:
+        raise ValueError('The coarse array {0}x{1} must divide the oversampled array {2}x{3}.'.format(My_coarse, Mz_coarse, k_oversampling*My, k_oversampling*Mz))
+
+    dtype = _complex_dtype(precision)
+    F_coarse = compute_wide_codebook(My, Mz, f_c, My_coarse, Mz_coarse).astype(dtype)
+    F = compute_bf_codebook(My, Mz, f_c, k_oversampling).astype(dtype)
+
+    Ny, Nz = k_oversampling * My, k_oversampling * Mz # fine beams per axis
+    ry, rz = Ny // My_coarse, Nz // Mz_coarse # fine beams per wide beam and axis
+    n_candidates = min(n_candidates, My_coarse * Mz_coarse)
+
+    # The fine beams under every wide beam, in (z, y) order; angles wrap
+    # around since theta = 0 and theta = pi steer to the same phase.
+    offset_z, offset_y = np.meshgrid(np.arange(rz) - rz // 2, np.arange(ry) - ry // 2, indexing='ij')
+    m_z, m_y = np.divmod(np.arange(F_coarse.shape[1]), My_coarse)
+    fine = ((m_z[:,None] * rz + offset_z.ravel()) % Nz) * Ny + (m_y[:,None] * ry + offset_y.ravel()) % Ny
+
+    n = H.shape[0]
+    gains = np.empty(n, dtype=F.real.dtype)
+    beams = np.empty(n, dtype=beam_index_dtype(F.shape[1]))
+    probes = np.empty(n, dtype=np.int32)
+    gap_dB = np.empty(n) if report else None
+
+    for start in np.arange(0, n, block_size):
+        stop = min(start + block_size, n)
+        h = H[start:stop,:].astype(dtype)
+
+        # Stage 1: wide beams
+        G_coarse = _gain_matrix(h, F_coarse)
+        candidates = np.argpartition(G_coarse, G_coarse.shape[1] - n_candidates, axis=1)[:, G_coarse.shape[1] - n_candidates:]
+
+        # Stage 2: only the fine beams under the candidates, one product per
+        # wide beam over the users that picked it
+        probed = fine[candidates]
+        G_probed = np.empty(probed.shape, dtype=gains.dtype)
+        for c in np.unique(candidates):
+            users, slot = np.nonzero(candidates == c)
+            G_probed[users, slot, :] = _gain_matrix(h[users,:], F[:, fine[c]])
+
+        probed, G_probed = probed.reshape(stop - start, -1), G_probed.reshape(stop - start, -1)
+        best = G_probed.argmax(axis=1)
+
+        gains[start:stop] = G_probed[np.arange(stop - start), best]
+        beams[start:stop] = probed[np.arange(stop - start), best]
+        probes[start:stop] = F_coarse.shape[1] + 1 + (np.diff(np.sort(probed, axis=1), axis=1) != 0).sum(axis=1)
+
+        if report:
+            exhaustive = _gain_matrix(h, F).max(axis=1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                gap_dB[start:stop] = 10*np.log10(np.where(exhaustive == gains[start:stop], 1, exhaustive / gains[start:stop]))
+
+    return gains, beams, probes, gap_dB
+
+def hierarchical_probes(My, Mz, k_oversampling=2, My_coarse=None, Mz_coarse=None, n_candidates=1):
+    # Beams probed per user by compute_hierarchical_beams, without running
+    # it: all the wide beams, then the fine beams of n_candidates of them.
+    My_coarse = My_coarse or max(1, My // 8)
+    Mz_coarse = Mz_coarse or Mz
+    n_candidates = min(n_candidates, My_coarse * Mz_coarse)
+
+    return My_coarse * Mz_coarse + n_candidates * (k_oversampling * My // My_coarse) * (k_oversampling * Mz // Mz_coarse)
+
+def hierarchical_report(H, My, Mz, f_c, k_oversampling=2, My_coarse=None, Mz_coarse=None, n_candidates=1, block_size=block_size):
+    # Probes and gap to the exhaustive search of compute_hierarchical_beams
+    # over the users of H.
+    gains, beams, probes, gap_dB = compute_hierarchical_beams(H, My, Mz, f_c, k_oversampling, My_coarse, Mz_coarse, n_candidates, block_size, report=True)
+
+    return {'users': len(gains), 'probes': float(np.mean(probes)), 'exhaustive_probes': My * Mz * k_oversampling ** 2,
+            'mean_gap_dB': float(np.mean(gap_dB)), 'max_gap_dB': float(np.max(gap_dB)), 'exact': float(np.mean(gap_dB == 0))}
+
+def compute_dft_codebook(My, Mz, k_oversampling=1):
+    # Oversampled 2-D DFT codebook: the steering vectors are spaced uniformly
+    # in spatial frequency (cos theta) rather than in angle.  Laid out like
+    # compute_bf_codebook, F = kron(Fz, Fy).
+    Fy = np.exp(2j * math.pi * np.outer(np.arange(My), np.arange(My*k_oversampling)) / (k_oversampling*My)) / math.sqrt(My)
+    Fz = np.exp(2j * math.pi * np.outer(np.arange(Mz), np.arange(Mz*k_oversampling)) / (k_oversampling*Mz)) / math.sqrt(Mz)
+
+    F = np.kron(Fz, Fy)
+
+    return F
+
+def is_dft_codebook(F, My, Mz, k_oversampling=1):
+    # True if F can be searched with compute_optimal_gains_fft.  Builds the
+    # dense DFT codebook, so the searches cache it per codebook (_is_dft).
+    if F.shape != (My*Mz, My*Mz*k_oversampling**2):
+        return False
+
+    return np.allclose(F, compute_dft_codebook(My, Mz, k_oversampling))
+
+def _compute_ula_codebook(M_ULA, f_c, k_oversampling=1):
+    F = np.zeros([M_ULA, M_ULA*k_oversampling], dtype=complex)
+
+    theta_n = math.pi * np.arange(start=0., stop=1., step=1./(k_oversampling*M_ULA))
+
+    for n in np.arange(M_ULA*k_oversampling):
+        F[:,n] = _compute_bf_vector(f_c, theta_n[n], M_ULA)
+
+    return F
+
+def _compute_bf_vector(f_c, theta, M_ULA):
+    # Create DFT beamforming codebook
+    c = 299792458 # speed of light
+    wavelength = c / f_c
+
+    d = wavelength / 2. # antenna spacing
+    k = 2. * math.pi / wavelength
+
+    exponent = 1j * k * d * math.cos(theta) * np.arange(M_ULA)
+
+    f = 1. / math.sqrt(M_ULA) * np.exp(exponent)
+
+    return f
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Blockage applied to the per-user 28 GHz beamforming gains.
+
+The blocked and unblocked gains are computed once (see gain_cache.py); a
+blockage realization only selects between them, so any
+(p_blockage_learning, p_blockage_exploitation) pair costs a mask draw;
+sweep.py sweeps them, with a spawned seed per point.
+"""
+
+import numpy as np
+
+def apply_blockage(gain_blocked, gain_unblocked, p_b):
+    # p_b is 1 where the user is blocked.  Also picks per user beams, of
+    # shape (users, top_k), with the same mask.
+    p_b = np.reshape(p_b, (-1,) + (1,) * (np.ndim(gain_blocked) - 1))
+    return np.where(p_b == 1, gain_blocked, gain_unblocked)
+
+def draw_blockage_masks(n_users, p_blockage_learning, p_blockage_exploitation, rng=np.random):
+    # Returns the blockage masks p_b of the learning and of the exploitation phase.
+    # Draws from rng in the same order as create_datasets always did.
+    # n_users may also be a shape, e.g. (replicates, users).
+    p_b = rng.binomial(1, p=p_blockage_learning, size=n_users)
+
+    # only overwrite p_b when the values are different.
+    p_b_exploit = p_b
+    if p_blockage_learning != p_blockage_exploitation:
+        p_b_exploit = rng.binomial(1, p=p_blockage_exploitation, size=n_users)
+
+    return p_b, p_b_exploit
+
+def draw_realization(n_users, n_exploit, p_randomness, p_blockage_learning, p_blockage_exploitation, rng, n_replicates=None):
+    # The random draws of a sweep point: (p_b, p_b_exploit, user_mask,
+    # exploit_indices), user_mask being 1 where the user is mmWave and
+    # exploit_indices n_exploit distinct users.  With n_replicates, every
+    # array gets a leading replicates axis and each row is an independent
+    # realization; a single replicate draws the same values as without.
+    shape = (n_users,) if n_replicates is None else (n_replicates, n_users)
+
+    p_b, p_b_exploit = draw_blockage_masks(shape, p_blockage_learning, p_blockage_exploitation, rng)
+    user_mask = rng.binomial(1, p_randomness, size=shape)
+
+    # The n_exploit smallest of i.i.d. uniforms are a uniform random subset
+    exploit_indices = np.argpartition(rng.random(shape), max(n_exploit - 1, 0), axis=-1)[..., :n_exploit]
+
+    return p_b, p_b_exploit, user_mask, exploit_indices
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Paired bootstrap confidence intervals of the throughput quantiles, mean rates
+and handover counts of the exploitation users.
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+from replicates import quantiles
+
+memory_budget = 2 ** 28 # bytes of working memory per chunk of resamples
+
+def resample_counts(n_users, n_resamples, rng):
+    # (n_resamples, n_users) number of draws of every user, n_resamples
+    # resamples of n_users users with replacement.
+    indices = rng.integers(0, n_users, size=(n_resamples, n_users))
+    indices += n_users * np.arange(n_resamples)[:,None]
+
+    counts = np.bincount(indices.ravel(), minlength=indices.size)
+    return counts.reshape(n_resamples, n_users).astype(np.int32)
+
+def resample_bytes(n_users):
+    # Working memory of one resample in bootstrap_statistics.
+    itemsizes = [np.dtype(np.int64).itemsize] * 2 + [np.dtype(np.int32).itemsize] * 2 + [np.dtype(float).itemsize]
+    return n_users * sum(itemsizes)
+
+def resample_quantiles(sorted_values, counts, quantiles, block=64):
+    # Quantiles of every resample of counts (in the order of sorted_values),
+    # interpolated linearly like np.quantile.
+    n_resamples, n_users = counts.shape
+    position = np.asarray(quantiles) * (n_users - 1)
+    below = np.floor(position).astype(np.int64)
+    above = np.minimum(below + 1, n_users - 1)
+    fraction = position - below
+
+    # Rank r of row i is where the cumulative counts of the flattened chunk
+    # cross i * n_users + r: first among blocks of users, then inside one.
+    m = n_users // block * block
+    block_sums = np.concatenate([counts[:,:m].reshape(n_resamples, -1, block).sum(axis=2),
+                                 counts[:,m:].sum(axis=1, keepdims=True)], axis=1)
+    cumulative = np.cumsum(block_sums.ravel())
+    rows = np.repeat(np.arange(n_resamples), 2 * len(quantiles))
+    ranks = np.tile(np.concatenate([below, above]), n_resamples) + n_users * rows
+
+    blocks = np.searchsorted(cumulative, ranks, side='right')
+    ranks -= np.where(blocks > 0, cumulative[blocks - 1], 0)
+    first_user = (blocks - rows * block_sums.shape[1]) * block
+
+    users = first_user[:,None] + np.arange(block)
+    inside = np.where(users < n_users, counts[rows[:,None], np.minimum(users, n_users - 1)], 0)
+    users = first_user + (np.cumsum(inside, axis=1) <= ranks[:,None]).sum(axis=1)
+
+    values = sorted_values[users].reshape(n_resamples, 2 * len(quantiles))
+    return values[:,:len(quantiles)] + fraction * (values[:,len(quantiles):] - values[:,:len(quantiles)])
+
+def bootstrap_statistics(rates, counts=None, n_resamples=10000, quantiles=quantiles, seed=0, memory_budget=memory_budget):
+    # {column or name: DataFrame} of the quantiles and mean of every column
+    # of rates and the count of every name of counts, one row per resample.
+    start_time = time.time()
+
+    counts = counts or {}
+    columns, names = list(rates), list(counts)
+    values = np.column_stack([np.asarray(rates[column], dtype=float) for column in columns] +
+                             [np.asarray(counts[name], dtype=float) for name in names])
+    n_users = values.shape[0]
+
+    orders = [np.argsort(values[:,j], kind='stable') for j in np.arange(len(columns))]
+    sorted_values = [values[order, j] for j, order in enumerate(orders)]
+
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    rows = max(1, memory_budget // max(resample_bytes(n_users), 1))
+    chunk_seeds = seed_sequence.spawn(-(-n_resamples // rows))
+
+    labels = ['q{}'.format(q) for q in quantiles] + ['mean']
+    statistics = {column: np.empty((n_resamples, len(labels))) for column in columns}
+    statistics.update({name: np.empty((n_resamples, 1)) for name in names})
+    for chunk, start in enumerate(np.arange(0, n_resamples, rows)):
+        stop = min(start + rows, n_resamples)
+        draws = resample_counts(n_users, stop - start, np.random.default_rng(chunk_seeds[chunk]))
+
+        # Sums of every column over every resample at once
+        sums = draws @ values
+        for j, column in enumerate(columns):
+            statistics[column][start:stop,:-1] = resample_quantiles(sorted_values[j], np.take(draws, orders[j], axis=1), quantiles)
+            statistics[column][start:stop,-1] = sums[:,j] / n_users
+        for j, name in enumerate(names):
+            statistics[name][start:stop,0] = sums[:,len(columns) + j]
+
+    elapsed = time.time() - start_time
+    print('INFO: {0} bootstrap resamples of {1} users in {2:.2f} s.'.format(n_resamples, n_users, elapsed))
+
+    result = {column: pd.DataFrame(statistics[column], columns=labels) for column in columns}
+    result.update({name: pd.DataFrame(statistics[name], columns=['count']) for name in names})
+    return result
+
+def bootstrap_intervals(rates, counts=None, n_resamples=10000, confidence=0.95, quantiles=quantiles, seed=0, memory_budget=memory_budget):
+    # Percentile bootstrap intervals, one row per (column, statistic): the
+    # estimate on the exploitation users and the lower and upper bounds.
+    counts = counts or {}
+    statistics = bootstrap_statistics(rates, counts, n_resamples, quantiles, seed, memory_budget)
+    lower, upper = 100 * (1 - confidence) / 2, 100 * (1 + confidence) / 2
+
+    rows = []
+    for column in statistics:
+        if column in counts:
+            estimates = [np.sum(counts[column])]
+        else:
+            values = np.asarray(rates[column], dtype=float)
+            estimates = list(np.quantile(values, quantiles)) + [np.mean(values)]
+
+        band = np.percentile(statistics[column].values, [lower, upper], axis=0)
+        for i, statistic in enumerate(statistics[column].columns):
+            rows.append({'column': column, 'statistic': statistic, 'estimate': estimates[i],
+                         'lower': band[0,i], 'upper': band[1,i]})
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binary channel store written by h5py_to_tab.py and read by the main scripts.
+
+A store is a directory shared by all band/blockage variants:
+    loc.npy           -- (users, 3) float64 user locations (lon, lat, height)
+    <variant>/H.npy   -- (users, antennas) complex64 channel of the first OFDM symbol
+    <variant>/meta.json -- source file, shape and the hash of the locations
+    manifest.json     -- export checkpoint: schema, sources and completed shards
+
+With the wideband export, every variant also holds the full channel:
+    <variant>/wideband/<start>.h5 -- (users, subcarriers, antennas) complex64 per shard
+    <variant>/H_wideband.h5       -- virtual dataset joining the shards in user order
+
+Arrays are opened as read-only memory maps, so nothing is parsed or copied
+until a slice is actually used.  Variants are aligned when their location
+hashes agree with each other and with loc.npy.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import h5py
+
+channel_file = 'H.npy'
+loc_file = 'loc.npy'
+meta_file = 'meta.json'
+manifest_file = 'manifest.json'
+wideband_file = 'H_wideband.h5'
+wideband_dir = 'wideband'
+
+chunk_elements = 2 ** 17 # complex64 elements per HDF5 chunk of the wideband channel (1 MB)
+
+def create_store(root, variant, n_users, n_antennas, dtype=np.complex64):
+    # Preallocates the channel of one variant and returns a writable memory map.
+    os.makedirs(os.path.join(root, variant), exist_ok=True)
+
+    return np.lib.format.open_memmap(os.path.join(root, variant, channel_file), mode='w+', dtype=dtype, shape=(n_users, n_antennas))
+
+def create_loc(root, n_users):
+    # Preallocates the shared location table and returns a writable memory map.
+    os.makedirs(root, exist_ok=True)
+
+    return np.lib.format.open_memmap(os.path.join(root, loc_file), mode='w+', dtype=float, shape=(n_users, 3))
+
+def open_store(root, variant, mode='r'):
+    # Returns (H, loc) as memory maps.  Use mode='r+' to fill a store
+    # created by create_store from another process.
+    H = np.load(os.path.join(root, variant, channel_file), mmap_mode=mode)
+    loc = open_loc(root, mode=mode)
+
+    return H, loc
+
+def open_loc(root, mode='r'):
+    return np.load(os.path.join(root, loc_file), mmap_mode=mode)
+
+def loc_hash(loc):
+    return hashlib.sha1(np.ascontiguousarray(loc, dtype=float).tobytes()).hexdigest()
+
+def write_meta(root, variant, **meta):
+    with open(os.path.join(root, variant, meta_file), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+def read_meta(root, variant):
+    with open(os.path.join(root, variant, meta_file), 'r') as f:
+        return json.load(f)
+
+def aligned(root, variants):
+    # True if all variants were exported against the shared location table.
+    shared = loc_hash(open_loc(root))
+
+    return all(read_meta(root, variant)['loc_sha1'] == shared for variant in variants)
+
+def variant_hash(root, variant):
+    # Content hash of the channel of one variant.  Taken from the shard
+    # hashes of the export manifest when there is one, so the channel itself
+    # does not have to be read.
+    manifest = read_manifest(root)
+    if manifest is not None and variant in manifest['shards']:
+        shards = manifest['shards'][variant]
+        digests = [shards[start]['H'] for start in sorted(shards, key=int)]
+        return hashlib.sha1(json.dumps([manifest['schema'], digests]).encode()).hexdigest()
+
+    H = np.load(os.path.join(root, variant, channel_file), mmap_mode='r')
+    digest = hashlib.sha1(str(H.shape).encode())
+    for start in np.arange(0, H.shape[0], 4096):
+        digest.update(np.ascontiguousarray(H[start:start+4096]).tobytes())
+
+    return digest.hexdigest()
+
+def read_manifest(root):
+    # Returns the export manifest of the store, or None if there is none.
+    path = os.path.join(root, manifest_file)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def write_manifest(root, manifest):
+    # Written to a temporary file first, so a killed job never leaves a
+    # truncated manifest behind.
+    os.makedirs(root, exist_ok=True)
+    path = os.path.join(root, manifest_file)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+def wideband_chunks(n_users, n_subcarriers, n_antennas):
+    # A chunk spans every antenna and a square-ish block of users x
+    # subcarriers, so both one user and one subcarrier touch few chunks.
+    per_antenna = max(1, chunk_elements // n_antennas)
+    n_sc = int(min(n_subcarriers, max(1, round(per_antenna ** 0.5))))
+    n_u = int(min(n_users, max(1, per_antenna // n_sc)))
+
+    return (n_u, n_sc, n_antennas)
+
+def write_wideband_shard(root, variant, start, H):
+    # Writes users [start, start + len(H)) of the (users, subcarriers, antennas)
+    # channel to their own file, so shards can be written by any process.
+    path = os.path.join(root, variant, wideband_dir)
+    os.makedirs(path, exist_ok=True)
+
+    with h5py.File(os.path.join(path, '{}.h5'.format(start)), 'w') as f:
+        f.create_dataset('H', data=H.astype(np.complex64), chunks=wideband_chunks(*H.shape))
+
+def link_wideband(root, variant, shards, n_subcarriers, n_antennas):
+    # Joins the shard files [(start, stop), ...] into one virtual dataset.
+    n_users = max(stop for _, stop in shards)
+    layout = h5py.VirtualLayout(shape=(n_users, n_subcarriers, n_antennas), dtype=np.complex64)
+    for start, stop in shards:
+        source = os.path.join(wideband_dir, '{}.h5'.format(start)) # relative to the virtual file
+        layout[start:stop] = h5py.VirtualSource(source, 'H', shape=(stop - start, n_subcarriers, n_antennas))
+
+    with h5py.File(os.path.join(root, variant, wideband_file), 'w') as f:
+        f.create_virtual_dataset('H', layout)
+
+def open_wideband(root, variant):
+    # Returns the (users, subcarriers, antennas) channel as a lazy h5py
+    # dataset; nothing is read until it is sliced.  Close it with H.file.close().
+    return h5py.File(os.path.join(root, variant, wideband_file), 'r')['H']
+
+def read_subcarriers(root, variant, subcarriers, users=slice(None)):
+    # Reads only the requested subcarriers of a slice of users and returns
+    # them as (users, len(subcarriers), antennas).
+    subcarriers = np.atleast_1d(subcarriers)
+    unique, inverse = np.unique(subcarriers, return_inverse=True)
+
+    H = open_wideband(root, variant)
+    try:
+        block = H[users, list(unique), :]
+    finally:
+        H.file.close()
+
+    return block[:, inverse, :]
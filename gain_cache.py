@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent cache of the per-user beamforming gains of every channel store
+variant, so the beam sweep only runs when its inputs change.
+
+Entries live in <store>/gains/<variant>/ and are keyed by the content hash
+of the variant's channel and the codebook parameters (My, Mz, f_c,
+k_oversampling).  Every precision and gain (last or best codeword, see
+beamforming.compute_optimal_gains) has its own entry under the key, and an
+entry keeps the most users and the largest top_k asked for so far: smaller
+requests are sliced from it, so callers asking for different numbers of
+users or top_k (e.g. the scripts and the sweep) share it.  Only entries
+under another key, i.e. of a changed channel or codebook, are removed.
+
+An entry is three arrays written by the same sweep:
+    <key>.<precision>.<gain>.npy           -- (users,) gain of the last ('last') or best ('max') codeword
+    <key>.<precision>.<gain>.beams.npy     -- (users, top_k) int16 indices of the best codewords
+    <key>.<precision>.<gain>.top_gains.npy -- (users, top_k) float32 gains of those codewords
+
+Missing entries are computed in blocks of users, optionally on a process
+pool: workers memory map the channel store themselves and write their
+block straight into the preallocated entry, so no channel is pickled.
+"""
+
+import os
+import time
+import glob
+import json
+import hashlib
+import numpy as np
+from multiprocessing import Pool
+
+from channel_store import open_store, variant_hash
+from beamforming import compute_bf_codebook, compute_optimal_beams, beam_index_dtype, precision_report, hierarchical_report, block_size
+
+cache_dir = 'gains'
+
+def cache_key(root, variant, My, Mz, f_c, k_oversampling=1):
+    params = {'channel': variant_hash(root, variant), 'variant': variant,
+              'My': int(My), 'Mz': int(Mz), 'f_c': float(f_c), 'k_oversampling': int(k_oversampling)}
+
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+def _entry_path(root, variant, key, precision, last_codeword):
+    return os.path.join(root, cache_dir, variant, '{0}.{1}.{2}'.format(key, precision, 'last' if last_codeword else 'max'))
+
+def _entry_shape(path):
+    # (users, top_k) of the entry at path, None if there is none.
+    if not all(os.path.exists(part) for part in _entry_files(path)):
+        return None
+
+    return np.load(_entry_files(path)[1], mmap_mode='r').shape
+
+def _entry_files(path, suffix=''):
+    # The gains, beams and top gains files of an entry.
+    return [path + part + suffix + '.npy' for part in ['', '.beams', '.top_gains']]
+
+def _gain_block(args):
+    # Process pool worker: beam sweep of users [start, stop) of one variant.
+    root, variant, out_path, start, stop, My, Mz, f_c, k_oversampling, precision, last_codeword, top_k = args
+
+    start_time = time.time()
+
+    H, _ = open_store(root, variant)
+    F = compute_bf_codebook(My=My, Mz=Mz, f_c=f_c, k_oversampling=k_oversampling)
+
+    result = compute_optimal_beams(H[start:stop,:], F, top_k=top_k, My=My, Mz=Mz, k_oversampling=k_oversampling, precision=precision, last_codeword=last_codeword)
+    for path, block in zip(_entry_files(out_path, '.tmp'), result):
+        out = np.load(path, mmap_mode='r+')
+        out[start:stop] = block
+        out.flush()
+        del out
+
+    return variant, stop - start, time.time() - start_time
+
+def cached_gains(root, variant, n_users, My, Mz, f_c, k_oversampling=1, precision='double', n_workers=1, last_codeword=True):
+    # Returns the compute_optimal_gains gains of the first n_users users of
+    # the variant, running the beam sweep only if no entry matches the key.
+    return cached_variant_gains(root, {variant: (My, Mz, f_c)}, n_users, k_oversampling, precision, n_workers, last_codeword=last_codeword)[variant]
+
+def cached_variant_gains(root, codebooks, n_users, k_oversampling=1, precision='double', n_workers=1, block_size=block_size, last_codeword=True):
+    # Same as cached_gains for several variants at once, {variant: (My, Mz, f_c)}.
+    beams = cached_variant_beams(root, codebooks, n_users, 1, k_oversampling, precision, n_workers, block_size, last_codeword)
+
+    return {variant: beams[variant][0] for variant in codebooks}
+
+def cached_variant_beams(root, codebooks, n_users, top_k=1, k_oversampling=1, precision='double', n_workers=1, block_size=block_size, last_codeword=True):
+    # Returns {variant: (gains, top_beams, top_gains)} as computed by
+    # compute_optimal_beams, running the beam sweep only for the variants
+    # whose entry has fewer users or a smaller top_k than asked for.
+    # The blocks of all missing variants share one process pool.
+    entries = {}
+    requests = {}
+    jobs = []
+    for variant in codebooks:
+        My, Mz, f_c = codebooks[variant]
+        n = min(n_users, open_store(root, variant)[0].shape[0])
+        k = min(top_k, My * Mz * k_oversampling ** 2)
+        path = _entry_path(root, variant, cache_key(root, variant, My, Mz, f_c, k_oversampling), precision, last_codeword)
+        entries[variant] = path
+        requests[variant] = (n, k)
+
+        shape = _entry_shape(path)
+        if shape is not None and shape[0] >= n and shape[1] >= k:
+            print('INFO: beamforming gains of {} read from the cache.'.format(variant))
+            continue
+
+        print('INFO: computing the beamforming gains of {}.'.format(variant))
+
+        # The new entry also covers what the current one held
+        if shape is not None:
+            n, k = max(n, shape[0]), max(k, shape[1])
+
+        # Preallocate the entry; workers fill their rows in place
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shapes = [(n,), (n, k), (n, k)]
+        dtypes = [np.float32 if precision == 'single' else float, beam_index_dtype(My * Mz * k_oversampling ** 2), np.float32]
+        for part, shape, dtype in zip(_entry_files(path, '.tmp'), shapes, dtypes):
+            out = np.lib.format.open_memmap(part, mode='w+', dtype=dtype, shape=shape)
+            del out
+
+        for start in np.arange(0, n, block_size):
+            jobs.append((root, variant, path, int(start), int(min(start + block_size, n)), My, Mz, f_c, k_oversampling, precision, last_codeword, k))
+
+    if len(jobs) > 0:
+        start_time = time.time()
+
+        if n_workers <= 1:
+            list(map(_gain_block, jobs))
+        else:
+            with Pool(processes=n_workers) as pool:
+                list(pool.imap_unordered(_gain_block, jobs))
+
+        elapsed = time.time() - start_time
+        n = sum(job[4] - job[3] for job in jobs)
+        print('INFO: beam sweep of {0} users on {1} process(es) in {2:.2f} s ({3:.0f} users/s).'.format(n, max(n_workers, 1), elapsed, n / max(elapsed, 1e-9)))
+
+        # Install the new entries and remove the ones of an older channel,
+        # codebook or file layout; the other precisions and gains under the
+        # same key are kept.
+        for variant in set(job[1] for job in jobs):
+            path = entries[variant]
+            for tmp, part in zip(_entry_files(path, '.tmp'), _entry_files(path)):
+                os.replace(tmp, part)
+
+            key = os.path.basename(path).split('.')[0]
+            for stale in glob.glob(os.path.join(os.path.dirname(path), '*.npy')):
+                name = os.path.basename(stale).split('.')
+                if name[0] != key or name[2] not in ['last', 'max']:
+                    os.remove(stale)
+
+    result = {}
+    for variant in codebooks:
+        (n, k), path = requests[variant], entries[variant]
+        gains, top_beams, top_gains = (np.load(part, mmap_mode='r') for part in _entry_files(path))
+        result[variant] = (np.array(gains[:n]), np.array(top_beams[:n,:k]), np.array(top_gains[:n,:k]))
+
+    return result
+
+def variant_precision_report(root, codebooks, n_users=4096, k_oversampling=1, last_codeword=True):
+    # Runs precision_report on the first n_users users of every variant.
+    report = {}
+    for variant in codebooks:
+        My, Mz, f_c = codebooks[variant]
+        H, _ = open_store(root, variant)
+        F = compute_bf_codebook(My=My, Mz=Mz, f_c=f_c, k_oversampling=k_oversampling)
+        report[variant] = precision_report(H[:n_users,:], F, My=My, Mz=Mz, k_oversampling=k_oversampling, last_codeword=last_codeword)
+        print('INFO: single precision gains of {0}: max error {1:.2e} dB, mean error {2:.2e} dB over {3} users.'.format(variant, report[variant]['max_dB_error'], report[variant]['mean_dB_error'], report[variant]['users']))
+
+    return report
+
+def variant_hierarchical_report(root, codebooks, n_users=4096, k_oversampling=2):
+    # Runs hierarchical_report on the first n_users users of every variant.
+    report = {}
+    for variant in codebooks:
+        My, Mz, f_c = codebooks[variant]
+        H, _ = open_store(root, variant)
+        report[variant] = hierarchical_report(H[:n_users,:], My, Mz, f_c, k_oversampling)
+        print('INFO: hierarchical beam search of {0} probes {1:.0f} of {2} beams per user, {3:.2f} dB mean ({4:.2f} dB max) below the exhaustive search over {5} users.'.format(variant, report[variant]['probes'], report[variant]['exhaustive_probes'], report[variant]['mean_gap_dB'], report[variant]['max_gap_dB'], report[variant]['users']))
+
+    return report
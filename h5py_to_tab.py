@@ -7,57 +7,298 @@ Created on Tue Jun  4 09:04:06 2019
 """
 
 import os
+import time
+import shutil
+import hashlib
 import numpy as np
 import h5py
 import pandas as pd
-import itertools
+from multiprocessing import Pool
+
+from channel_store import create_store, create_loc, open_store, open_loc, loc_hash, write_meta, read_manifest, write_manifest
+from channel_store import write_wideband_shard, link_wideband, channel_file, loc_file
 
 # This implements DeepMIMO_dataset{0,0}.user{0}.channel
-os.chdir('/Users/farismismar/Desktop/DeepMIMO')
-
-f = h5py.File('./DeepMIMO_Dataset_Generation v1.1/DeepMIMO Dataset/28_GHz_no_block_DeepMIMO_dataset.mat', 'r')
-
-# Best practice
-# Finds out the keys in the dataset.
-#for key in f.keys():
-#   print(key)
-   
-dataset = f['DeepMIMO_dataset']
-
-# 1) Obtain {0,0} from Matlab
-users = f[dataset[0,0]]['user']
-
-# Best practice
-# users[...] shows this is an array of 54481 references 
-# - To dereference an h5py element, do f[.] around that element.
-# Reference: https://groups.google.com/forum/#!topic/h5py/Q6wdqo3GnQ0
-
-df = pd.DataFrame()
-for userid in np.arange(54481).astype(int):
-    
-    # 2) Now the user in element i (or basically time step i)
-    user_i = f[users[userid,0]]
-    user_id_i = [userid]
-    channel_i = np.transpose(user_i['channel'])
-    loc_i = np.transpose(user_i['loc'][:])
-
-    # 3) Take the first symbol as RS
-    channel_i_rs = channel_i[:,0]        
-    H_i = pd.DataFrame(channel_i_rs)
-    H_i = [H_i.iloc[:,0].values, H_i.iloc[:,1].values]
-    H_i = np.array(list(itertools.chain.from_iterable(H_i))) # all reals in H first then all imag in H
-    
-    # 4) Create an entry
-    row_i = [user_id_i, H_i, loc_i.ravel()] # user ID | vec([real(H)]_i) | vec([imag(H)]_i) | x | y | z
-    row_i = np.array(list(itertools.chain.from_iterable(row_i)))
-    df_i = pd.DataFrame(row_i)
-    df_i = df_i.T
-        
-    df = pd.concat([df, df_i])
-    
-# 5) Set the proper types
-df.iloc[:,0] = df.iloc[:,0].astype(int) # id
-df.iloc[:,-3:] = df.iloc[:,-3:].astype(float) # (x,y,z)
-
-# 6) Write back to csv
-df.to_csv('dataset/dataset_28_GHz.csv', index=False)
\ No newline at end of file
+# Every band/blockage variant is exported in one pass: variant -> .mat file
+mat_path = './DeepMIMO_Dataset_Generation v1.1/DeepMIMO Dataset'
+scenarios = {'3.5_GHz': '{}/3.5_GHz_DeepMIMO_dataset.mat'.format(mat_path),
+             '28_GHz': '{}/28_GHz_no_block_DeepMIMO_dataset.mat'.format(mat_path),
+             '28_GHz_blockage': '{}/28_GHz_block_DeepMIMO_dataset.mat'.format(mat_path)}
+store_root = 'dataset' # the channel store shared by all variants
+
+max_users = 54481
+chunk_size = 4096 # users dereferenced and written per block
+n_workers = 1 # > 1 splits the users across a process pool
+wideband = False # also export every OFDM subcarrier, not only the first (RS) one
+wideband_shard_bytes = 2 ** 28 # complex64 channel bytes per variant read in one wideband shard
+
+def open_users(f):
+    # Best practice
+    # Finds out the keys in the dataset.
+    #for key in f.keys():
+    #   print(key)
+    dataset = f['DeepMIMO_dataset']
+
+    # 1) Obtain {0,0} from Matlab
+    # users[...] shows this is an array of 54481 references
+    # - To dereference an h5py element, do f[.] around that element.
+    # Reference: https://groups.google.com/forum/#!topic/h5py/Q6wdqo3GnQ0
+    return f[dataset[0,0]]['user']
+
+def read_users(f, users, start, stop, wideband=False, dtype=complex):
+    # Dereferences users [start, stop) and returns (user_id, H, loc) where
+    # H holds the first OFDM symbol (the RS) of every antenna, or with
+    # wideband=True, every subcarrier as (users, subcarriers, antennas).
+    # H is allocated as dtype, e.g. complex64 for the channel store.
+    refs = users[start:stop, 0]
+    n = len(refs)
+
+    H = None
+    loc = np.empty((n, 3))
+    for i, ref in enumerate(refs):
+        # 2) Now the user in element i (or basically time step i)
+        user_i = f[ref]
+
+        # 3) Take the first symbol as RS: channel is stored transposed, so
+        # row 0 on disk is channel_i[:,0] in Matlab.  Only read that row.
+        channel_i = user_i['channel'][...] if wideband else user_i['channel'][0]
+        if H is None:
+            H = np.empty((n,) + channel_i.shape, dtype=dtype)
+        H[i].real = channel_i['real']
+        H[i].imag = channel_i['imag']
+        loc[i,:] = user_i['loc'][:].ravel()
+
+    user_id = np.arange(start, stop)
+
+    return user_id, H, loc
+
+def _get_shape(mat_file, n_users):
+    # Returns the number of users to convert, of subcarriers and of antennas.
+    with h5py.File(mat_file, 'r') as f:
+        users = open_users(f)
+        n_subcarriers, n_antennas = f[users[0,0]]['channel'].shape
+        return min(n_users, users.shape[0]), n_subcarriers, n_antennas
+
+def _split(n_users, n_workers):
+    # Splits the user ID range into one contiguous range per worker.
+    bounds = np.linspace(0, n_users, n_workers + 1).astype(int)
+
+    return [(k, bounds[k], bounds[k+1]) for k in np.arange(n_workers) if bounds[k+1] > bounds[k]]
+
+def _run_pool(worker, jobs, n_workers):
+    # Runs the jobs on a process pool and reports users/s of every worker.
+    results = []
+    with Pool(processes=n_workers) as pool:
+        for result in pool.imap_unordered(worker, jobs):
+            shard, n, elapsed = result[:3]
+            print('INFO: worker {0} converted {1} users in {2:.2f} s ({3:.0f} users/s).'.format(shard, n, elapsed, n / max(elapsed, 1e-9)))
+            results.append(result)
+
+    return sorted(results, key=lambda result: result[0])
+
+##############################################################################
+# Binary channel store: all variants in one pass, checkpointed per shard
+##############################################################################
+def _source_stat(mat_file):
+    st = os.stat(mat_file)
+
+    return {'file': mat_file, 'size': st.st_size, 'mtime': st.st_mtime}
+
+def _export_shard(args):
+    # Process pool worker: exports users [start, stop) of the given variants.
+    # Each worker opens its own read-only handles.  The first variant of the
+    # store owns the shared location table.  Returns the hashes of every
+    # block written so the manifest can record the shard as complete.
+    shard, scenarios, variants, store_root, loc_owner, start, stop, wideband = args
+
+    start_time = time.time()
+    digests = {}
+    for variant in variants:
+        with h5py.File(scenarios[variant], 'r') as f:
+            _, H, loc = read_users(f, open_users(f), start, stop, wideband=wideband, dtype=np.complex64)
+
+        digest = hashlib.sha1(H.tobytes()).hexdigest()
+        if wideband:
+            write_wideband_shard(store_root, variant, start, H)
+            H = H[:,0,:]
+
+        H_out, loc_out = open_store(store_root, variant, mode='r+')
+        H_out[start:stop,:] = H
+        H_out.flush()
+        if variant == loc_owner:
+            loc_out[start:stop,:] = loc
+            loc_out.flush()
+        del H_out, loc_out
+
+        digests[variant] = {'H': digest, 'loc': loc_hash(loc)}
+
+    return shard, (stop - start) * len(variants), time.time() - start_time, os.getpid(), digests
+
+def _new_manifest(store_root, scenarios, schema):
+    # Creates an empty store and its manifest.
+    for variant in scenarios:
+        H = create_store(store_root, variant, schema['n_users'], schema['n_antennas'][variant])
+        del H
+    loc = create_loc(store_root, schema['n_users'])
+    del loc
+
+    return {'schema': schema, 'sources': {}, 'shards': {variant: {} for variant in scenarios}}
+
+def _store_exists(store_root, scenarios):
+    paths = [os.path.join(store_root, variant, channel_file) for variant in scenarios]
+
+    return all(os.path.exists(path) for path in paths + [os.path.join(store_root, loc_file)])
+
+def export(scenarios, store_root=store_root, n_users=max_users, chunk_size=chunk_size, n_workers=n_workers, wideband=wideband, resume=True):
+    # Streams the users of every variant out of their .mat files in shards of
+    # chunk_size users, so the memory is bounded by one shard and the run
+    # time is linear in n_users.
+    #
+    # Completed shards are recorded in the manifest of the store.  A rerun
+    # skips them; a variant whose source file changed (size or mtime) has
+    # its shards read again, and those whose content changed are reported.
+    #
+    # With wideband=True the full (subcarriers x antennas) channel of every
+    # user is written as well; see channel_store.open_wideband.  Shards are
+    # then cut to wideband_shard_bytes of channel per variant, since a user
+    # holds every subcarrier.
+    variants = list(scenarios)
+    shapes = [_get_shape(scenarios[variant], n_users) for variant in variants]
+    n_users = min(n_users_ for n_users_, _, _ in shapes)
+
+    if wideband:
+        user_bytes = max(n_subcarriers * n_antennas for _, n_subcarriers, n_antennas in shapes) * np.dtype(np.complex64).itemsize
+        chunk_size = max(1, min(chunk_size, wideband_shard_bytes // user_bytes))
+
+    schema = {'variants': variants, 'n_users': int(n_users), 'shard_size': int(chunk_size), 'dtype': 'complex64',
+              'n_antennas': {variant: int(n_antennas) for variant, (_, _, n_antennas) in zip(variants, shapes)},
+              'n_subcarriers': {variant: int(n_subcarriers) for variant, (_, n_subcarriers, _) in zip(variants, shapes)},
+              'wideband': bool(wideband)}
+
+    manifest = read_manifest(store_root) if resume else None
+    if manifest is None or manifest['schema'] != schema or not _store_exists(store_root, scenarios):
+        manifest = _new_manifest(store_root, scenarios, schema)
+
+    # A changed source file invalidates only the shards of its own variant
+    stale = []
+    for variant in variants:
+        if manifest['sources'].get(variant) != _source_stat(scenarios[variant]):
+            stale.append(variant)
+            manifest['sources'][variant] = _source_stat(scenarios[variant])
+
+    previous = {variant: dict(manifest['shards'][variant]) for variant in stale}
+    for variant in stale:
+        manifest['shards'][variant] = {}
+    write_manifest(store_root, manifest)
+
+    jobs = []
+    for shard, start in enumerate(np.arange(0, n_users, chunk_size)):
+        todo = [variant for variant in variants if str(start) not in manifest['shards'][variant]]
+        if len(todo) > 0:
+            jobs.append((shard, scenarios, todo, store_root, variants[0], int(start), int(min(start + chunk_size, n_users)), wideband))
+
+    print('INFO: {0} of {1} shards to export.'.format(len(jobs), int(np.ceil(n_users / chunk_size))))
+
+    start_time = time.time()
+    worker_stats = {}
+
+    pool = Pool(processes=n_workers) if n_workers > 1 else None
+    try:
+        results = map(_export_shard, jobs) if pool is None else pool.imap_unordered(_export_shard, jobs)
+        for shard, n, elapsed, pid, digests in results:
+            start = str(shard * chunk_size)
+            for variant in digests:
+                old = previous.get(variant, {}).get(start)
+                if old is not None and old != digests[variant]:
+                    print('INFO: shard {0} of {1} changed in the source and was exported again.'.format(shard, variant))
+                manifest['shards'][variant][start] = digests[variant]
+
+            # Checkpoint after every shard
+            write_manifest(store_root, manifest)
+
+            n_, elapsed_ = worker_stats.get(pid, (0, 0.))
+            worker_stats[pid] = (n_ + n, elapsed_ + elapsed)
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    for pid in worker_stats:
+        n, elapsed = worker_stats[pid]
+        print('INFO: worker {0} exported {1} user records in {2:.2f} s ({3:.0f} users/s).'.format(pid, n, elapsed, n / max(elapsed, 1e-9)))
+
+    # Check that locations are the same for every variant
+    for start in manifest['shards'][variants[0]]:
+        for variant in variants:
+            if manifest['shards'][variant][start]['loc'] != manifest['shards'][variants[0]][start]['loc']:
+                raise ValueError('Locations of {0} differ from {1} in the shard starting at user {2}.'.format(variant, variants[0], start))
+
+    if wideband:
+        shards = [(start, min(start + chunk_size, n_users)) for start in np.arange(0, n_users, chunk_size)]
+        for variant in variants:
+            link_wideband(store_root, variant, shards, schema['n_subcarriers'][variant], schema['n_antennas'][variant])
+
+    shared = loc_hash(open_loc(store_root))
+    for variant in variants:
+        write_meta(store_root, variant, source=scenarios[variant], n_users=int(n_users),
+                   n_antennas=schema['n_antennas'][variant], n_subcarriers=schema['n_subcarriers'][variant],
+                   wideband=bool(wideband), dtype='complex64', loc_sha1=shared)
+
+    elapsed = time.time() - start_time
+    n = sum(len(job[2]) * (job[6] - job[5]) for job in jobs)
+    print('INFO: exported {0} user records of {1} variants in {2:.2f} s ({3:.0f} users/s).'.format(n, len(variants), elapsed, n / max(elapsed, 1e-9)))
+
+    return n_users
+
+##############################################################################
+# Legacy CSV table
+##############################################################################
+def _write_csv_block(output_file, user_id, H, loc, header):
+    # user ID | vec([real(H)]_i) | vec([imag(H)]_i) | x | y | z
+    M = H.shape[1]
+    block = pd.DataFrame(np.column_stack([H.real, H.imag, loc]), columns=np.arange(1, 2*M+4))
+    block.insert(0, 0, user_id)
+    block.to_csv(output_file, index=False, header=header, mode='w' if header else 'a')
+
+def _convert_shard(args):
+    # Process pool worker: each worker opens its own read-only handle.
+    shard, mat_file, shard_file, first, last, chunk_size = args
+
+    start_time = time.time()
+    with h5py.File(mat_file, 'r') as f:
+        users = open_users(f)
+        for start in np.arange(first, last, chunk_size):
+            stop = min(start + chunk_size, last)
+            user_id, H, loc = read_users(f, users, start, stop)
+            _write_csv_block(shard_file, user_id, H, loc, header=(shard == 0 and start == first))
+
+    return shard, last - first, time.time() - start_time
+
+def convert_csv(mat_file, output_file, n_users=max_users, chunk_size=chunk_size, n_workers=n_workers):
+    # Writes one variant as the legacy CSV table.  With several workers,
+    # each writes its own shard and the shards are merged in user order.
+    n_users, _, _ = _get_shape(mat_file, n_users)
+
+    start_time = time.time()
+
+    if n_workers <= 1:
+        _convert_shard((0, mat_file, output_file, 0, n_users, chunk_size))
+    else:
+        shards = _split(n_users, n_workers)
+        shard_files = ['{0}.part{1}'.format(output_file, shard) for shard, _, _ in shards]
+        jobs = [(shard, mat_file, shard_file, first, last, chunk_size) for (shard, first, last), shard_file in zip(shards, shard_files)]
+        _run_pool(_convert_shard, jobs, n_workers)
+
+        with open(output_file, 'wb') as out:
+            for shard_file in shard_files:
+                with open(shard_file, 'rb') as part:
+                    shutil.copyfileobj(part, out)
+                os.remove(shard_file)
+
+    elapsed = time.time() - start_time
+    print('INFO: converted {0} users in {1:.2f} s ({2:.0f} users/s).'.format(n_users, elapsed, n_users / max(elapsed, 1e-9)))
+
+    return n_users
+
+if __name__ == '__main__':
+    os.chdir('/Users/farismismar/Desktop/DeepMIMO')
+    export(scenarios)
@@ -42,6 +42,16 @@ from matplotlib.ticker import MultipleLocator, FuncFormatter
 from mpl_toolkits.mplot3d import Axes3D
 
 import matplotlib2tikz
+
+from channel_store import open_loc, aligned
+from beamforming import hierarchical_probes
+from rates import noise_power, shannon_rate, bs_distance, coherence_time_surface, effective_rate_coefficients, beam_training_penalties
+from gain_cache import cached_variant_beams, variant_precision_report, variant_hierarchical_report
+from policies import evaluate_policies, policy_frame, threshold_sweep
+from results import append
+from bootstrap import bootstrap_intervals
+from sketches import kll_cdf, histogram2d_cdf
+from blockage import draw_blockage_masks, apply_blockage
     
 os.chdir('/Users/farismismar/Desktop/DeepMIMO')
 
@@ -64,6 +74,7 @@ rate_threshold_mmWave = 7.00
 
 training_request_handover_threshold = np.inf #(1 - p_randomness) * rate_threshold_sub6 + p_randomness * rate_threshold_mmWave  # this is x_hr, but only for the training data.
 request_handover_threshold = (1 - p_randomness) * rate_threshold_sub6 + p_randomness * rate_threshold_mmWave  # this is x_hr
+request_handover_thresholds = np.union1d(np.linspace(0, 2 * rate_threshold_mmWave, 57), [request_handover_threshold]) # x_hr values of the threshold sweep, with the one above
 
 # in ms
 gap_fraction = 0.6 # rho
@@ -85,11 +96,21 @@ B_35 = N_SC_35 * delta_f_35
 B_28 = N_SC_28 * delta_f_28 * mmWave_BW_multiplier
 Nf = 7 # dB noise fig.
 
-k_B = 1.38e-23 # Boltzmann
 T = 290 # Kelvins
 
+n_workers = 1 # processes for the beam sweep in create_dataset(s)
+precision = 'double' # or 'single': complex64 beam sweep and float32 P_RX columns
+top_k = 4 # best beams per user kept as dataset columns
+last_codeword = True # P_RX from the last codeword, as the original per-user loop; False for the best codeword
+hierarchical_beam_search = False # beam training penalty from the probes of the hierarchical search
+n_bootstrap = 0 # resamples of the bootstrap confidence intervals of the exploitation rates; 0 skips them
+
 N_exploit = int(q_exploitation * max_users)
 
+# Key of the rows of this run in the result store (results.py)
+run_key = {'backend': 'fc_tf', 'seed': seed, 'p_randomness': p_randomness, 'p_blockage_learning': p_blockage_learning,
+           'p_blockage_exploitation': p_blockage_exploitation, 'q_exploitation': q_exploitation}
+
 # 1) Read the data
 # Add a few lines to caputre the seed for reproducibility.
 random.seed(seed)
@@ -99,165 +120,70 @@ set_random_seed(seed)
 # Changed for review R2
 # on 6/30/2020
 def create_datasets(p_blockage_learning=0.4, p_blockage_exploitation=0.4):
-    # Takes the three.csv files and merges them in a way that is useful for the Deep Learning.
+    # Takes the three channel store variants and merges them in a way that is useful for the Deep Learning.
     # regenerate the dataset for 3.5 (y,z = 8x4) and 28 (y, z = 64x4)
-    df35 = pd.read_csv('dataset/dataset_3.5_GHz.csv')
-    df28_b = pd.read_csv('dataset/dataset_28_GHz_blockage.csv')
-    df28_nb = pd.read_csv('dataset/dataset_28_GHz.csv')
-    
-    # Truncate to the first max_users rows, for efficiency for now
-    df35 = df35.iloc[:max_users,:]
-    df28_b = df28_b.iloc[:max_users,:]
-    df28_nb = df28_nb.iloc[:max_users,:]
-    
+    # The beam sweep only runs for the variants whose channels or codebook
+    # changed since the last run; otherwise the gains come from the cache.
     sub6_Y, sub6_Z = 8, 4
     mmWave_Y, mmWave_Z = 64, 4
     
-    # Check that distances are similar
-    assert(np.all(df28_b.iloc[:,-3:] == df28_nb.iloc[:,-3:]))
-    
-    # Based on blocking probability, create df28: one for learning
-    # and one for exploitation phase
-    p_b = np.random.binomial(1, p=p_blockage_learning, size=max_users)
-    df28 = df28_b.copy()
-    df28.loc[(p_b==1),:] = df28_b.loc[(p_b == 1),:]
-    df28.loc[(p_b==0),:] = df28_nb.loc[(p_b == 0),:]
-    
-    # only overwrite p_b when the values are different.
-    if p_blockage_learning != p_blockage_exploitation:
-        p_b = np.random.binomial(1, p=p_blockage_exploitation, size=max_users)
-    df28_exploitation = df28_b.copy()
-    df28_exploitation.loc[(p_b==1),:] = df28_b.loc[(p_b == 1),:]
-    df28_exploitation.loc[(p_b==0),:] = df28_nb.loc[(p_b == 0),:]
-    
-    # Map: 0 is ID; 1-YZ+1 are H real; YZ+1-2YZ+1 are Himag; last three are x,y,z 
-    # 2) Perform data wrangling and construct the proper channel matrix H
-    H35_real = df35.iloc[:,1:(sub6_Y*sub6_Z+1)]
-    H35_imag = df35.iloc[:,(sub6_Y*sub6_Z+1):(2*sub6_Y*sub6_Z+1)]
-    H35_loc = df35.iloc[:,-3:]
-        
-    H28_real = df28.iloc[:,1:(mmWave_Y*mmWave_Z+1)]
-    H28_imag = df28.iloc[:,(mmWave_Y*sub6_Z+1):(2*mmWave_Y*mmWave_Z+1)]
-    H28_loc = df28.iloc[:,-3:]    
-       
-    H28_exploit_real = df28_exploitation.iloc[:,1:(mmWave_Y*mmWave_Z+1)]
-    H28_exploit_imag = df28_exploitation.iloc[:,(mmWave_Y*sub6_Z+1):(2*mmWave_Y*mmWave_Z+1)]
-    H28_exploit_loc = df28_exploitation.iloc[:,-3:]    
-       
-    # Before moving forward, check if the loc at time t is equal
-    df35 = df35.rename(columns={df35.columns[-3]:  'lon', 
-                         df35.columns[-2]:  'lat', 
-                         df35.columns[-1]:  'height'})
-
-    df28 = df28.rename(columns={df28.columns[-3]:  'lon', 
-                         df28.columns[-2]:  'lat', 
-                         df28.columns[-1]:  'height'})
-    
-    df28_exploitation = df28_exploitation.rename(columns={df28_exploitation.columns[-3]:  'lon', 
-                     df28_exploitation.columns[-2]:  'lat', 
-                     df28_exploitation.columns[-1]:  'height'})
-    
-    assert(np.all(df35.iloc[:,-3:] == df28.iloc[:,-3:]))
-    assert(np.all(df28.iloc[:,-3:] == df28_exploitation.iloc[:,-3:]))
-    
-    # Reset the column names of the imaginary H
-    H35_imag.columns = H35_real.columns
-    H28_imag.columns = H28_real.columns
-    H28_exploit_imag.columns = H28_exploit_real.columns
-    
-    H35 = H35_real + 1j * H35_imag
-    H28 = H28_real + 1j * H28_imag
-    H28_exploit = H28_exploit_real + 1j * H28_exploit_imag
-    
-    del H35_loc, H28_real, H28_imag, H28_loc
-    del H28_exploit_real, H28_exploit_imag, H28_exploit_loc
-    
-    F_35 = compute_bf_codebook(My=sub6_Y, Mz=sub6_Z, f_c=3.5e9)
-    F_28 = compute_bf_codebook(My=mmWave_Y, Mz=mmWave_Z, f_c=28e9)
-    
-    channel_gain_35 = []
-    channel_gain_28 = []
-    channel_gain_28_exploit = []
+    # Check that distances are similar: all variants share one location table
+    assert(aligned('dataset', ['3.5_GHz', '28_GHz', '28_GHz_blockage']))
+    
+    # Truncate to the first max_users rows, for efficiency for now
+    loc = open_loc('dataset')[:max_users,:]
     
     # Compute the channel gain |h*f|
     # Beamforming is now both vertical and horizontal
-    for i in np.arange(max_users):
-        h35_i = np.array(H35.iloc[i,:])
-        h28_i = np.array(H28.iloc[i,:])
-        h28_exploit_i = np.array(H28_exploit.iloc[i,:])
-        
-        channel_gain_35.append(compute_optimal_gain_bf_vector(h35_i, F_35))
-        channel_gain_28.append(compute_optimal_gain_bf_vector(h28_i, F_28))
-        channel_gain_28_exploit.append(compute_optimal_gain_bf_vector(h28_exploit_i, F_28))
-        
+    # The users of all variants are swept in blocks on n_workers processes
+    codebooks = {'3.5_GHz': (sub6_Y, sub6_Z, 3.5e9),
+                 '28_GHz': (mmWave_Y, mmWave_Z, 28e9),
+                 '28_GHz_blockage': (mmWave_Y, mmWave_Z, 28e9)}
+    # The same sweep keeps the top_k beams of every user
+    beams = cached_variant_beams('dataset', codebooks, max_users, top_k=top_k, precision=precision, n_workers=n_workers, last_codeword=last_codeword)
+    
+    # Report how far the single precision gains are from the double ones
+    if precision == 'single':
+        variant_precision_report('dataset', codebooks, last_codeword=last_codeword)
+    
+    channel_gain_35, beams_35, beam_gains_35 = beams['3.5_GHz']
+    channel_gain_28_nb, beams_28_nb, beam_gains_28_nb = beams['28_GHz']
+    channel_gain_28_b, beams_28_b, beam_gains_28_b = beams['28_GHz_blockage']
+    
+    # Based on blocking probability, create the 28 GHz gains: one for learning
+    # and one for exploitation phase.  The gain is per user, so picking the
+    # blocked or unblocked gain is the same as picking the channel.
+    # The beams of a user follow the same mask.
+    p_b, p_b_exploit = draw_blockage_masks(len(channel_gain_28_b), p_blockage_learning, p_blockage_exploitation)
+    channel_gain_28 = apply_blockage(channel_gain_28_b, channel_gain_28_nb, p_b)
+    channel_gain_28_exploit = apply_blockage(channel_gain_28_b, channel_gain_28_nb, p_b_exploit)
+    
     # 3) Feature engineering: introduce RSRP mmWave and sub-6 and y
-    channel_gain_35 = np.array(channel_gain_35).astype(float)
-    channel_gain_28 = np.array(channel_gain_28).astype(float)
-    channel_gain_28_exploit = np.array(channel_gain_28_exploit).astype(float)
+    df = pd.DataFrame(np.array(loc), columns=['lon', 'lat', 'height'])
+    df.insert(0, 'user_id', np.arange(df.shape[0]))
     
-    # Get rid of unwanted columns in 3.5
-    df35 = df35[['0', 'lon', 'lat', 'height']]
-    df35.columns = ['user_id', 'lon', 'lat', 'height']
-
-    df = df35.copy()    
     df.loc[:,'P_RX_35'] = 10*np.log10(PTX_35 * 1e3 * channel_gain_35)
     df.loc[:,'P_RX_28'] = 10*np.log10(PTX_28 * 1e3 * channel_gain_28)
     df.loc[:,'P_RX_28_exploit'] = 10*np.log10(PTX_28 * 1e3 * channel_gain_28_exploit)
     
+    # Best beam and the top_k (beam, gain) pairs of every band
+    beam_columns = []
+    for band, top_beams, top_gains in [('35', beams_35, beam_gains_35),
+                                       ('28', apply_blockage(beams_28_b, beams_28_nb, p_b), apply_blockage(beam_gains_28_b, beam_gains_28_nb, p_b)),
+                                       ('28_exploit', apply_blockage(beams_28_b, beams_28_nb, p_b_exploit), apply_blockage(beam_gains_28_b, beam_gains_28_nb, p_b_exploit))]:
+        df.loc[:,'beam_{}'.format(band)] = top_beams[:,0]
+        beam_columns.append('beam_{}'.format(band))
+        for i in np.arange(top_beams.shape[1]):
+            df.loc[:,'beam_{0}_top{1}'.format(band, i+1)] = top_beams[:,i]
+            df.loc[:,'gain_{0}_top{1}'.format(band, i+1)] = top_gains[:,i]
+            beam_columns += ['beam_{0}_top{1}'.format(band, i+1), 'gain_{0}_top{1}'.format(band, i+1)]
+    
     df = df.iloc[:max_users,:]
-    df = df[['user_id', 'lon', 'lat', 'height', 'P_RX_35', 'P_RX_28', 'P_RX_28_exploit']]
+    df = df[['user_id', 'lon', 'lat', 'height', 'P_RX_35', 'P_RX_28', 'P_RX_28_exploit'] + beam_columns]
     df.to_csv('dataset.csv', index=False)
     
     return df
 
-def compute_optimal_gain_bf_vector(h, F):
-    M, MK = F.shape
-
-    max_gain = 0
-
-    for code_index in np.arange(MK):
-        f_i = F[:,code_index]
-        channel_gain = abs(np.vdot(h, f_i)) ** 2
-        if (channel_gain > max_gain):
-            max_gain = channel_gain
-            
-    return channel_gain
-    
-def compute_bf_codebook(My, Mz, f_c, k_oversampling=1):
-    Fy = np.zeros([My, My*k_oversampling], dtype=complex) # F is M rows by Mk columns, where M corresponds to the antennas in the horizontal direction
-
-    theta_y_n = math.pi * np.arange(start=0., stop=1., step=1./(k_oversampling*My))
-
-    for n in np.arange(My*k_oversampling):
-        f_n = _compute_bf_vector(f_c, theta_y_n[n], My)
-        Fy[:,n] = f_n
-            
-    Fz = np.zeros([Mz, Mz*k_oversampling], dtype=complex) # F is M rows by Mk columns, where M corresponds to the antennas in the horizontal direction
-
-    theta_z_n = math.pi * np.arange(start=0., stop=1., step=1./(k_oversampling*Mz))
-
-    for n in np.arange(Mz*k_oversampling):
-        f_n = _compute_bf_vector(f_c, theta_z_n[n], Mz)
-        Fz[:,n] = f_n
-
-    F = np.kron(Fz, Fy)
-    
-    return F
-
-def _compute_bf_vector(f_c, theta, M_ULA):
-    # Create DFT beamforming codebook
-    c = 299792458 # speed of light
-    wavelength = c / f_c
-    
-    d = wavelength / 2. # antenna spacing 
-    k = 2. * math.pi / wavelength
-
-    exponent = 1j * k * d * math.cos(theta) * np.arange(M_ULA)
-    
-    f = 1. / math.sqrt(M_ULA) * np.exp(exponent)
-    
-    return f
-
 def get_misclassification_error(y_test, y_pred, y_score):
     cm = confusion_matrix(y_test, y_pred)
     tn, fp, fn, tp  = cm.ravel()
@@ -417,7 +343,9 @@ def plot_joint_pdf(X, Y):
     plt.savefig('figures/joint_throughput_pdf_{}.pdf'.format(p_randomness), format='pdf')
     matplotlib2tikz.save('figures/joint_throughput_pdf_{}.tikz'.format(p_randomness))
 
-def plot_joint_cdf(X, Y):
+def plot_joint_cdf(X, Y=None):
+    # X and Y are the throughputs, or X is a 2-D histogram of them
+    # accumulated with sketches.histogram2d_update and Y is None.
     fig = plt.figure(figsize=(10.24, 7.68))
     plt.rc('text', usetex=True)
     plt.rc('font', family='serif')
@@ -430,15 +358,13 @@ def plot_joint_cdf(X, Y):
         r'\usepackage{amssymb}']   
     
     num_bins = 100
-    H, X_bin_edges, Y_bin_edges = np.histogram2d(X, Y, bins=(num_bins, num_bins), normed=True)
-    for y in np.arange(num_bins):
-        H[y,:] = H[y,:] / sum(H[y,:])
-    pdf = H / num_bins
-    
-    cdf = np.zeros((num_bins, num_bins))
-    for i in np.arange(num_bins):
-        for j in np.arange(num_bins):
-            cdf[i,j] = sum(sum(pdf[:(i+1), :(j+1)]))
+    if Y is not None:
+        H, X_bin_edges, Y_bin_edges = np.histogram2d(X, Y, bins=(num_bins, num_bins))
+        X = {'x_edges': X_bin_edges, 'y_edges': Y_bin_edges, 'counts': H}
+
+    X_bin_edges, Y_bin_edges = X['x_edges'], X['y_edges']
+    num_bins = len(X_bin_edges) - 1
+    cdf = histogram2d_cdf(X)
 
     ax = plt.gca(projection="3d")
     x, y = np.meshgrid(X_bin_edges, Y_bin_edges)
@@ -464,8 +390,8 @@ def plot_joint_cdf(X, Y):
     ax.invert_xaxis()
     ax.invert_yaxis()
     
-    ax.set_xlim(int(np.max(X)), 0)
-    ax.set_ylim(int(np.max(Y)), 0)
+    ax.set_xlim(int(X_bin_edges[-1]), 0)
+    ax.set_ylim(int(Y_bin_edges[-1]), 0)
     ax.set_zlim(0,1)
 
     ax.xaxis.labelpad=20
@@ -518,6 +444,8 @@ def plot_pdf(data1, label1, data2, label2):
     matplotlib2tikz.save('figures/coherence_time_{}.tikz'.format(p_randomness))
     
 def plot_throughput_cdf(T, filename, legend=True):
+    # T is a DataFrame of throughputs, or {column: quantile sketch} such as
+    # the sketches of a sketches.accumulator.
     fig = plt.figure(figsize=(10.24, 7.68))
     plt.rc('text', usetex=True)
     plt.rc('font', family='serif')
@@ -530,15 +458,19 @@ def plot_throughput_cdf(T, filename, legend=True):
         r'\usepackage{amsmath}',
         r'\usepackage{amssymb}']   
     
-    labels = T.columns
+    labels = list(T)
 
     num_bins = 50
 
     for data in T:
-        data_ = T[data]
+        if isinstance(T, dict):
+            bin_edges = np.linspace(T[data]['min'], T[data]['max'], num_bins + 1)
+            cdf = kll_cdf(T[data], bin_edges[1:])
+        else:
+            data_ = T[data]
 
-        counts, bin_edges = np.histogram(data_, bins=num_bins, density=True)
-        cdf = np.cumsum(counts) / counts.sum()
+            counts, bin_edges = np.histogram(data_, bins=num_bins, density=True)
+            cdf = np.cumsum(counts) / counts.sum()
         ax = fig.gca()
         if data == 'mmWave only':
             style = 'r-'
@@ -735,74 +667,57 @@ def predict_handover(df, clf, r_training):
         # Compute area under ROC curve
         roc_auc = roc_auc_score(y_test, y_score[:,1])
         print('The ROC AUC for the exploitation period is {:.6f}'.format(roc_auc))
-    
-        # Save the value
-        f = open("figures/output_fc_{}.txt".format(p_randomness), 'a')
-        f.write('q_exploitation {0}, r_training {1}, ROC {2:.6f}\n'.format(q_exploitation, r_training, roc_auc))
-        f.close()
 
         y_pred=pd.DataFrame(y_pred)
       
-    except:
+    except ValueError:
        print('The ROC AUC for the exploitation period is N/A')
        y_pred = None
        roc_auc = None
-       
+    
     return y_pred, roc_auc
 ##############################################################################
     
-def get_beam_training_time(df, freq=28e9, horiz_beams=32, vertical_beams=8):
-    return 10e-3 * horiz_beams * vertical_beams # 10 us in ms per beam.
-
-def get_coherence_time(df, My, freq):
+def get_coherence_time(df, My, freq, v_s=v_s):
     # Returns beam coherence time in ms.
-    c = 299792458 # speed of light
-    
-    BS_x, BS_y, BS_z = [235.504198, 489.503816, 6]
+    # My, freq and the speed v_s can also be arrays: the result is then the
+    # (speeds, array sizes, frequencies) surface, from one draw of alpha.
     np.random.seed(seed)
 
     n = df.shape[0]    
     
     # Obtain D
     # alpha AoA equivalent random(0, pi) or 30 to 150 degrees
-
-    D = ((df['lon'] - BS_x) ** 2 + (df['lat'] - BS_y) ** 2 + (df['height'] - BS_z) ** 2) ** 0.5
-    Theta_n = 102 / My * math.pi/180 # beamwidth approximation for ULA ### 64 antennas in the aziumuth direction # 3 dB BW of antenna
+    D = bs_distance(df['lon'].values, df['lat'].values, df['height'].values)
     alpha = np.random.uniform(0, math.pi, size=n)
-    T_B = D / (v_s * 1000/3600 * np.sin(alpha)) * Theta_n / 2.
 
-    T_beam = np.array(T_B) * 1e3 # in ms
-    T_beam = np.percentile(T_beam, 1) # take the 1st percentile of coherence
+    # take the 1st percentile of coherence
+    T = coherence_time_surface(D, alpha, v_s, My, freq, q=1) # in ms
     
-    if freq >= 28e9:
-        print('INFO: mmWave mean channel coherence time is {} ms'.format(T_beam.mean()))
-        return T_beam        
-  
-    T_ofdm = np.ones(n) * c / (freq * v_s * np.sin(alpha) * 1000/3600) * 1e3 # in ms
-    T_ofdm = np.percentile(T_ofdm, 1) 
+    if np.ndim(v_s) > 0 or np.ndim(My) > 0 or np.ndim(freq) > 0:
+        return T
     
-    T = np.minimum(T_ofdm, T_beam)
-
-    print('INFO: sub-6 mean channel coherence time is {} ms'.format(T.mean()))
+    T = T[0,0,0]
+    if freq >= 28e9:
+        print('INFO: mmWave mean channel coherence time is {} ms'.format(T.mean()))
+    else:
+        print('INFO: sub-6 mean channel coherence time is {} ms'.format(T.mean()))
     return T
 
 # This is where the code starts executing.
-# only uncomment for the first run, when the channel consideration changes.  Otherwise, no need.
+# The beam sweep is cached, so this only recomputes the gains when the channel consideration changes.
 df_ = create_datasets(p_blockage_learning=p_blockage_learning, p_blockage_exploitation=p_blockage_exploitation) 
 df = df_.iloc[:max_users,:]
 #del df_
 
 # Feature engineering: add SNR to the computation:
-noise_floor_35 = k_B * T * delta_f_35 * 1e3
-noise_floor_28 = k_B * T * delta_f_28 * mmWave_BW_multiplier * 1e3 # in mW
-
-noise_power_35 = 10 ** (Nf/10.) * noise_floor_35
-noise_power_28 = 10 ** (Nf/10.) * noise_floor_28 
+noise_power_35 = noise_power(delta_f_35, Nf, T)
+noise_power_28 = noise_power(delta_f_28, Nf, T, mmWave_BW_multiplier) # in mW
 
 # Instantaneous rates (Shannon)
-df['Capacity_35'] = B_35*np.log2(1 + 10**(df['P_RX_35']/10.) / noise_power_35) / 1e6
-df['Capacity_28'] = B_28*np.log2(1 + 10**(df['P_RX_28']/10.) / noise_power_28) / 1e6
-df['Capacity_28_exploit'] = B_28*np.log2(1 + 10**(df['P_RX_28_exploit']/10.) / noise_power_28) / 1e6
+df['Capacity_35'] = shannon_rate(df['P_RX_35'].values, B_35, noise_power_35)
+df['Capacity_28'] = shannon_rate(df['P_RX_28'].values, B_28, noise_power_28)
+df['Capacity_28_exploit'] = shannon_rate(df['P_RX_28_exploit'].values, B_28, noise_power_28)
 
 df = df[['lon', 'lat', 'height', 'Capacity_35', 'Capacity_28', 'Capacity_28_exploit']]
 
@@ -830,16 +745,19 @@ coherence_time_sub6 = np.mean(coherence_time_sub6)
 gap_duration_sub6 = gap_fraction * coherence_time_sub6
 gap_duration_mmWave  = gap_fraction * coherence_time_mmWave
 
-beam_training_penalty_mmWave = get_beam_training_time(df, freq=28e9, horiz_beams=8, vertical_beams=32)
-beam_training_penalty_sub6 = get_beam_training_time(df, freq=2.1e9, horiz_beams=8, vertical_beams=8)
+if hierarchical_beam_search:
+    # Every user probes the same number of beams; the report runs the
+    # exhaustive search too, on a sample of users, for the gap to it.
+    variant_hierarchical_report('dataset', {'3.5_GHz': (8, 4, 3.5e9), '28_GHz': (64, 4, 28e9)})
+    beam_training_penalty_sub6, beam_training_penalty_mmWave = beam_training_penalties(hierarchical_probes(8, 4), hierarchical_probes(64, 4))
+else:
+    beam_training_penalty_sub6, beam_training_penalty_mmWave = beam_training_penalties()
 
 # Write the formulas in Paper
-coeff_sub6_no_ho = (coherence_time_sub6 - beam_training_penalty_sub6) / coherence_time_sub6
-coeff_mmWave_no_ho = (coherence_time_mmWave - beam_training_penalty_mmWave) / coherence_time_mmWave
-coeff_sub6_ho = (coherence_time_sub6 - beam_training_penalty_sub6 - gap_duration_sub6) / coherence_time_sub6
-coeff_mmWave_ho = (coherence_time_mmWave - beam_training_penalty_mmWave - gap_duration_mmWave) / coherence_time_mmWave
+coeff_sub6_no_ho, coeff_sub6_ho = effective_rate_coefficients(coherence_time_sub6, beam_training_penalty_sub6, gap_duration_sub6)
+coeff_mmWave_no_ho, coeff_mmWave_ho = effective_rate_coefficients(coherence_time_mmWave, beam_training_penalty_mmWave, gap_duration_mmWave)
 
-df.to_csv('figures/dataset_rates_{}.csv'.format(p_randomness))
+append('dataset_rates', df.reset_index().rename(columns={'index': 'user_id'}), **run_key)
 
 df['Source_is_3.5'] = (df['Source'] == df['Capacity_35']) + 0
 df['Source_is_28'] = (df['Source'] == df['Capacity_28']) + 0
@@ -851,99 +769,27 @@ mmWave_capacities = df.loc[exploit_indices, 'Capacity_28_exploit'].copy()
 column_order = ['lon', 'lat', 'height', 'Source', 'Target', 'Source_is_3.5', 'Source_is_28']
 df = df[column_order]
 
+# All four policies are evaluated in one pass over the Source/Target rates.
+# The proposed rates use the true handover label y, the classifier
+# predictions are only used for the handover counts below.
+policy_rates = evaluate_policies(df['Source'].values, df['Target'].values, df['Source_is_3.5'].values == 1, df['Source_is_28'].values == 1, request_handover_threshold,
+                                 coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+
 ##############################################################################
 # 1) Optimal algorithm
 ##############################################################################
-df_optimal = df.copy()
-df_optimal_ = df.copy()
-
-# Now, apply the handover algorithm
-# and compute the Effective Achievable Rate but no penalty for handover
 
-a = df_optimal_.loc[(df_optimal_['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho
-b = df_optimal_.loc[(df_optimal_['Source_is_3.5'] == 1), 'Target'] * coeff_mmWave_no_ho
-c = df_optimal_.loc[(df_optimal_['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho
-d = df_optimal_.loc[(df_optimal_['Source_is_28'] == 1), 'Target'] * coeff_sub6_no_ho
-
-# The NaNs here are due to p_randomness values.
-df_optimal_ = pd.DataFrame([a, b, c, d]).T
-df_optimal_.fillna(0, axis=1, inplace=True)
-
-# Choose the max rate regardless
-df_optimal.loc[:,'Capacity_Optimal'] = df_optimal_.apply(np.max, axis=1)
-      
-# Sample r_exploit data randomly from df_optimal
-benchmark_data_optimal = df_optimal.iloc[exploit_indices, :]
-
-del df_optimal, a, b, d, df_optimal_
+# Choose the max rate regardless, with no penalty for handover
+# Sample r_exploit data randomly from the optimal policy
+benchmark_data_optimal = policy_frame(policy_rates, 'optimal', exploit_indices)
 
 ##############################################################################
-# 2) Legacy algorithm
+# 2) Legacy and 3) Blind algorithms
 ##############################################################################
-df_legacy = df.copy()
-
-# Handover is based on raw Shannon rates.
-df_legacy.loc[:, 'HO_requested'] = (df_legacy.loc[:, 'Source'] < request_handover_threshold) + 0
-df_legacy.loc[:, 'y'] = (df_legacy.loc[:,'Target'] >= df_legacy.loc[:,'Source']) + 0
-
-# No handover request means no handover granted
-df_legacy.loc[df_legacy['HO_requested'] == 0, 'y'] = 0
-
-# Now, apply the handover algorithm
-# and compute the Effective Achievable Rate
-
-# Based on x_hr, if there was no handover, put the source effective rates back
-df_legacy.loc[(df_legacy['HO_requested'] == 0) & (df_legacy['Source_is_3.5'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 0) & (df_legacy['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover requested.
-df_legacy.loc[(df_legacy['HO_requested'] == 0) & (df_legacy['Source_is_28'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 0) & (df_legacy['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover requested.
-
-# Handover requested, but denied.  Therefore, the source rate penalized by the gap
-df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 0) & (df_legacy['Source_is_3.5'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 0) & (df_legacy['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_ho # handover requested but denied, the throughput is the source.
-df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 0) & (df_legacy['Source_is_28'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 0) & (df_legacy['Source_is_28'] == 1), 'Source'] * coeff_mmWave_ho # handover requested but denied, the throughput is the source.
-
-# Handover requested, and granted.  Therefore, the target rate penalized by the gap
-df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 1) & (df_legacy['Source_is_3.5'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 1) & (df_legacy['Source_is_3.5'] == 1), 'Target'] * coeff_sub6_ho # handover requested and granted, the throughput is the target.
-df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 1) & (df_legacy['Source_is_28'] == 1), 'Capacity_Legacy'] = df_legacy.loc[(df_legacy['HO_requested'] == 1) & (df_legacy['y'] == 1) & (df_legacy['Source_is_28'] == 1), 'Target'] * coeff_mmWave_ho # handover requested and granted, the throughput is the target.
-##
 
-# Sample r_exploit data randomly from df_legacy
-benchmark_data_legacy = df_legacy.iloc[exploit_indices, :]
-
-del df_legacy
-
-##############################################################################
-# 3) Blind handover algorithm
-##############################################################################
-df_blind = df.copy()
-
-df_blind['HO_requested'] = pd.DataFrame((df_blind.loc[:,'Source'] <= request_handover_threshold), dtype=int)
-df_blind['y'] = 1
-
-# No handover request means no handover granted
-df_blind.loc[df_blind['HO_requested'] == 0, 'y'] = 0
-
-# Now, apply the handover algorithm
-# and compute the Effective Achievable Rate
-#df_blind.loc[(df_blind['y'] == 0) & (df_blind['Source_is_3.5'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['y'] == 0)  & (df_blind['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover, the throughput is the source.
-#df_blind.loc[(df_blind['y'] == 0) & (df_blind['Source_is_28'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['y'] == 0)  & (df_blind['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover, the throughput is the source.
-
-# Based on x_hr, if there was no handover, put the source effective rates back
-df_blind.loc[(df_blind['HO_requested'] == 0) & (df_blind['Source_is_3.5'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 0) & (df_blind['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover, the throughput is the source but no gap.
-df_blind.loc[(df_blind['HO_requested'] == 0) & (df_blind['Source_is_28'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 0) & (df_blind['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover, the throughput is the source but no gap.
-
-# Handover requested, but denied.  Therefore, the source rate penalized but no gap
-df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 0) & (df_blind['Source_is_3.5'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 0) & (df_blind['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover, the throughput is the source but no gap.
-df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 0) & (df_blind['Source_is_28'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 0) & (df_blind['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover, the throughput is the source but no gap.
-
-# Handover requested, and granted.  Therefore, the target rate penalized but no gap
-df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 1) & (df_blind['Source_is_3.5'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 1) & (df_blind['Source_is_3.5'] == 1), 'Target'] * coeff_mmWave_no_ho # blind handover, the throughput is the target but no gap.
-df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 1) & (df_blind['Source_is_28'] == 1), 'Capacity_Blind'] = df_blind.loc[(df_blind['HO_requested'] == 1) & (df_blind['y'] == 1) & (df_blind['Source_is_28'] == 1), 'Target'] * coeff_sub6_no_ho # blind handover, the throughput is the target but no gap.
-
-##
-
-# Sample r_exploit data randomly from df_blind
-benchmark_data_blind = df_blind.iloc[exploit_indices, :]
-
-del df_blind
+# Sample r_exploit data randomly from the legacy and blind policies
+benchmark_data_legacy = policy_frame(policy_rates, 'legacy', exploit_indices)
+benchmark_data_blind = policy_frame(policy_rates, 'blind', exploit_indices)
 
 ##############################################################################
 # 4) Proposed algorithm
@@ -953,11 +799,9 @@ del df_blind
 height = df['height']
 df_proposed = df.drop(['height', 'Source_is_28'], axis=1) # delete the 28 column since it is equal to not 3.5.
 
-df_proposed.loc[:, 'HO_requested'] = (df_proposed.loc[:, 'Source'] < request_handover_threshold) + 0
-df_proposed.loc[:, 'y'] = (df_proposed.loc[:,'Target'] >= df_proposed.loc[:,'Source']) + 0
-
-# No handover request means no handover granted
-df_proposed.loc[df_proposed['HO_requested'] == 0, 'y'] = 0
+# The requests and true handover labels of the policy engine
+df_proposed.loc[:, 'HO_requested'] = policy_rates['proposed']['HO_requested']
+df_proposed.loc[:, 'y'] = policy_rates['proposed']['y']
 
 if (p_randomness == 0 or p_randomness == 1):
     df_proposed = df_proposed.drop(['Source_is_3.5'], axis=1) # these two values will make the column of a single value.
@@ -978,9 +822,6 @@ benchmark_data_proposed = df_proposed.iloc[exploit_indices, :]
 # The training and validation data get the infinity threshold (always request).
 train_valid.loc[:, 'HO_requested'] = 1
 
-roc_graphs = pd.DataFrame()
-misclass_graphs = pd.DataFrame()
-
 roc_auc_values = []
 misclass_error_values = []
 
@@ -1004,22 +845,28 @@ for r_t in X:
         roc_auc_values.append(score)
         misclass_error_values.append(mu)
         
-        roc_graphs = pd.concat([roc_graphs, pd.DataFrame(roc_auc_values)], axis=1)
-        misclass_graphs = pd.concat([misclass_graphs, pd.DataFrame(misclass_error_values)], axis=1)
-        
     except:
         roc_auc_values.append(np.nan)
         misclass_error_values.append(np.nan)
         pass
 
-roc_graphs.to_csv('figures/roc_output_{}.csv'.format(p_randomness), index=False)
-misclass_graphs.to_csv('figures/misclass_output_{}.csv'.format(p_randomness), index=False)
+append('training', {'r_training': X, 'roc_auc': roc_auc_values, 'misclass_error': misclass_error_values}, **run_key)
 
 # Now generate data with the best classifier.
-y_pred_proposed, _ = predict_handover(benchmark_data_proposed, best_clf, min_r_training)
+y_pred_proposed, roc_auc_proposed = predict_handover(benchmark_data_proposed, best_clf, min_r_training)
+# The ROC AUC of every other r_training is in the training table
+if roc_auc_proposed is not None:
+    append('roc', {'roc_auc': [roc_auc_proposed]}, r_training=min_r_training, **run_key)
 y_score_proposed = best_clf.predict_proba(benchmark_data_proposed.drop(['y'], axis=1))
 y_test_proposed = benchmark_data_proposed['y']
 
+# Predictions of the best classifier at every x_hr of the threshold sweep.
+# HO_requested is a feature, so the exploitation users are predicted once
+# per threshold, all in one batch, scaled like in predict_handover.
+X_proposed = benchmark_data_proposed.drop(['y'], axis=1)
+X_sweep = pd.concat([X_proposed.assign(HO_requested=(X_proposed['Source'] < x_hr) + 0) for x_hr in request_handover_thresholds])
+y_pred_sweep = np.reshape(best_clf.predict(scaler.transform(X_sweep)), (len(request_handover_thresholds), -1))
+
 # Put back the height column
 benchmark_data_proposed['height'] = height
 
@@ -1029,18 +876,7 @@ benchmark_data_proposed['Source_is_28'] = df.loc[benchmark_data_proposed.index,
 
 # Penalize the throughput rates aka Effective Achievable Rate
 # Use the same formula as the blind formula
-
-# Based on x_hr, if there was no handover, put the source effective rates back
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 0) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 0) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover, the throughput is the source but no gap.
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 0) & (benchmark_data_proposed['Source_is_28'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 0) & (benchmark_data_proposed['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover, the throughput is the source but no gap.
-
-# Handover requested, but denied.  Therefore, the source rate penalized but no gap
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 0) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 0) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Source'] * coeff_sub6_no_ho # no handover, the throughput is the source but no gap.
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 0) & (benchmark_data_proposed['Source_is_28'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 0) & (benchmark_data_proposed['Source_is_28'] == 1), 'Source'] * coeff_mmWave_no_ho # no handover, the throughput is the source but no gap.
-
-# Handover requested, and granted.  Therefore, the target rate penalized but no gap
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 1) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 1) & (benchmark_data_proposed['Source_is_3.5'] == 1), 'Target'] * coeff_mmWave_no_ho # blind handover, the throughput is the target but no gap.
-benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 1) & (benchmark_data_proposed['Source_is_28'] == 1), 'Capacity_Proposed'] = benchmark_data_proposed.loc[(benchmark_data_proposed['HO_requested'] == 1) & (benchmark_data_proposed['y'] == 1) & (benchmark_data_proposed['Source_is_28'] == 1), 'Target'] * coeff_sub6_no_ho # blind handover, the throughput is the target but no gap.
+benchmark_data_proposed.loc[:, 'Capacity_Proposed'] = policy_rates['proposed']['Capacity'][benchmark_data_proposed.index]
 ##
 
 ##############################################################################
@@ -1066,17 +902,30 @@ benchmark_data_proposed.loc[:,'y_true'] = benchmark_data_proposed['y'].copy()
 benchmark_data_proposed['y'] = y_pred_proposed
 
 # Summaries
-f = open('figures/handover_metrics_{}.txt'.format(p_randomness), 'w')
-for policy in ['proposed', 'legacy', 'blind']:
-    d_ = eval('benchmark_data_{}'.format(policy))
-    f.write('Policy {0} -- number of handovers requested in exploitation phase: {1:.0f}\n'.format(policy, d_['HO_requested'].sum()))
-    f.write('Policy {0} -- number of handovers granted in exploitation phase: {1:.0f}\n'.format(policy, d_['y'].sum()))
-f.close()
+benchmark_data = {'proposed': benchmark_data_proposed, 'legacy': benchmark_data_legacy, 'blind': benchmark_data_blind}
+append('handovers', {'policy': list(benchmark_data),
+                     'requested': [benchmark_data[policy]['HO_requested'].sum() for policy in benchmark_data],
+                     'granted': [benchmark_data[policy]['y'].sum() for policy in benchmark_data]}, **run_key)
     
 # After R2
 data = pd.concat([benchmark_data_optimal['Capacity_Optimal'], benchmark_data_proposed['Capacity_Proposed'], benchmark_data_proposed['HO_requested'], benchmark_data_legacy['Capacity_Legacy'], benchmark_data_blind['Capacity_Blind'], sub_6_capacities['Capacity_35'], mmWave_capacities['Capacity_28_exploit']], axis=1, ignore_index=True)
 data.columns = ['Optimal', 'Proposed', 'HO_requested', 'Legacy', 'Blind', 'Sub-6 only', 'mmWave only']
-data.to_csv('figures/dataset_post_{}.csv'.format(p_randomness), index=False)
+append('post', data, **run_key)
+
+# Bootstrap confidence intervals of the throughput quantiles, mean rates and handover counts
+if n_bootstrap > 0:
+    ho_counts = {}
+    for policy in benchmark_data:
+        ho_counts['HO_requested_{}'.format(policy)] = benchmark_data[policy]['HO_requested'].values
+        ho_counts['HO_granted_{}'.format(policy)] = benchmark_data[policy]['y'].values
+    append('bootstrap', bootstrap_intervals(data.drop(['HO_requested'], axis=1), ho_counts, n_resamples=n_bootstrap, seed=seed), **run_key)
+
+# Sweep x_hr over the exploitation data, with the grant rules of
+# evaluate_policies and the handovers the best classifier grants at each x_hr
+x_hr_sweep = threshold_sweep(df['Source'].values[exploit_indices], df['Target'].values[exploit_indices],
+                             df['Source_is_3.5'].values[exploit_indices] == 1, df['Source_is_28'].values[exploit_indices] == 1, request_handover_thresholds,
+                             coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho, y_pred=y_pred_sweep)
+append('x_hr_sweep', x_hr_sweep, **run_key)
 
 #plot_throughput_pdf(data)
 plot_throughput_cdf(data[['Sub-6 only', 'mmWave only']], 'throughput_cdf_{}'.format(p_randomness))
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Handover policy engine shared by main_fc_tf.py and main_xgboost.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+def effective_rate(source, target, source_is_sub6, ho_requested, y, coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho, gap=True):
+    # Effective achievable rate of every user: Target if a requested handover
+    # is granted, Source otherwise.  With gap=True (legacy) a request pays
+    # the measurement gap of the source band.
+    requested = (ho_requested == 1)
+    granted = requested & (y == 1)
+
+    coeff = np.where(source_is_sub6, coeff_sub6_no_ho, coeff_mmWave_no_ho)
+    if gap:
+        coeff = np.where(requested, np.where(source_is_sub6, coeff_sub6_ho, coeff_mmWave_ho), coeff)
+    else:
+        coeff = np.where(granted, np.where(source_is_sub6, coeff_mmWave_no_ho, coeff_sub6_no_ho), coeff)
+
+    return np.where(granted, target, source) * coeff
+
+def optimal_rate(source, target, source_is_35, source_is_28, coeff_sub6_no_ho, coeff_mmWave_no_ho):
+    # Best of staying and handing over with no handover penalty; NaN for
+    # users in neither band.
+    candidates = np.array([np.where(source_is_35, source * coeff_sub6_no_ho, 0),
+                           np.where(source_is_35, target * coeff_mmWave_no_ho, 0),
+                           np.where(source_is_28, source * coeff_mmWave_no_ho, 0),
+                           np.where(source_is_28, target * coeff_sub6_no_ho, 0)])
+    candidates[np.isnan(candidates)] = 0
+
+    rate = candidates.max(axis=0)
+    rate[~(source_is_35 | source_is_28)] = np.nan
+
+    return rate
+
+def evaluate_policies(source, target, source_is_35, source_is_28, request_handover_threshold, coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho, y_proposed=None):
+    # Returns {policy: {'HO_requested', 'y', 'Capacity'}} for every user of
+    # the optimal, legacy, blind and proposed (granted by y_proposed) policies.
+    coeffs = (coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+    source_is_sub6 = ~source_is_28
+
+    ho_legacy = (source < request_handover_threshold) + 0
+    y_legacy = (target >= source) * ho_legacy # no handover request means no handover granted
+
+    ho_blind = (source <= request_handover_threshold) + 0
+    y_blind = ho_blind
+
+    if y_proposed is None:
+        y_proposed = y_legacy
+
+    return {'optimal': {'Capacity': optimal_rate(source, target, source_is_35, source_is_28, coeff_sub6_no_ho, coeff_mmWave_no_ho)},
+            'legacy': {'HO_requested': ho_legacy, 'y': y_legacy,
+                       'Capacity': effective_rate(source, target, source_is_sub6, ho_legacy, y_legacy, *coeffs, gap=True)},
+            'blind': {'HO_requested': ho_blind, 'y': y_blind,
+                      'Capacity': effective_rate(source, target, source_is_sub6, ho_blind, y_blind, *coeffs, gap=False)},
+            'proposed': {'HO_requested': ho_legacy, 'y': y_proposed,
+                         'Capacity': effective_rate(source, target, source_is_sub6, ho_legacy, y_proposed, *coeffs, gap=False)}}
+
+def policy_frame(rates, policy, indices):
+    # HO_requested, y and Capacity_<Policy> of the users at indices, indexed
+    # like the rows of the script's frame.
+    columns = {}
+    for key in rates[policy]:
+        column = 'Capacity_{}'.format(policy.capitalize()) if key == 'Capacity' else key
+        columns[column] = rates[policy][key][indices]
+
+    return pd.DataFrame(columns, index=indices)
+
+def threshold_sweep(source, target, source_is_35, source_is_28, thresholds, coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho, y_pred=None):
+    # evaluate_policies at every x_hr in thresholds, one row per threshold;
+    # y_pred, the (thresholds, users) predictions, counts the proposed grants.
+    # Sorted by Source, the requests of any threshold are a prefix.
+    coeffs = (coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+    source_is_sub6 = ~source_is_28
+    thresholds = np.atleast_1d(thresholds)
+    n = len(source)
+
+    order = np.argsort(source, kind='stable')
+    source, target, source_is_sub6 = source[order], target[order], source_is_sub6[order]
+
+    # Whether a request would be granted, per policy
+    granted = {'legacy': (target >= source) + 0,
+               'blind': np.ones(n, dtype=int),
+               'proposed': (target >= source) + 0}
+
+    table = pd.DataFrame({'x_hr': thresholds})
+    for policy in ['legacy', 'blind', 'proposed']:
+        gap = (policy == 'legacy')
+        stay = effective_rate(source, target, source_is_sub6, 0, 0, *coeffs, gap=gap)
+        request = effective_rate(source, target, source_is_sub6, 1, granted[policy], *coeffs, gap=gap)
+
+        # Blind requests at the threshold too
+        requesting = np.searchsorted(source, thresholds, side='right' if policy == 'blind' else 'left')
+
+        stay_sum = np.concatenate([[0], np.cumsum(stay)])
+        request_sum = np.concatenate([[0], np.cumsum(request)])
+        granted_sum = np.concatenate([[0], np.cumsum(granted[policy])])
+
+        table['HO_requested_{}'.format(policy)] = requesting
+        table['HO_granted_{}'.format(policy)] = granted_sum[requesting]
+        table['Capacity_{}'.format(policy.capitalize())] = (request_sum[requesting] + stay_sum[-1] - stay_sum[requesting]) / n
+
+    if y_pred is not None:
+        predicted_sum = np.concatenate([np.zeros((len(thresholds), 1), dtype=int), np.cumsum(np.asarray(y_pred)[:, order], axis=1)], axis=1)
+        table['HO_granted_proposed'] = predicted_sum[np.arange(len(thresholds)), table['HO_requested_proposed'].values]
+
+    table['Capacity_Optimal'] = np.nanmean(optimal_rate(source, target, source_is_35[order], source_is_28[order], coeff_sub6_no_ho, coeff_mmWave_no_ho))
+
+    return table
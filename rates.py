@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Link budget, Shannon rate and coherence time kernels shared by main_fc_tf.py
+and main_xgboost.py; every function broadcasts its arguments.
+"""
+
+import math
+import numpy as np
+
+chunk_elements = 2 ** 22 # users x grid points per chunk of the coherence time sweep
+
+beam_time = 10e-3 # ms per beam probed (10 us)
+training_beams_sub6 = (8, 8) # horizontal x vertical beams probed by the exhaustive search
+training_beams_mmWave = (8, 32)
+
+c = 299792458 # speed of light
+k_B = 1.38e-23 # Boltzmann
+
+BS_x, BS_y, BS_z = [235.504198, 489.503816, 6] # base station location
+
+def noise_power(delta_f, Nf, T=290, bandwidth_multiplier=1):
+    # Noise power in mW over bandwidth_multiplier PRBs of delta_f Hz with
+    # a noise figure of Nf dB.
+    noise_floor = k_B * T * delta_f * np.asarray(bandwidth_multiplier) * 1e3
+    return 10 ** (np.asarray(Nf)/10.) * noise_floor
+
+def shannon_rate(P_RX, B, noise_power, out=None, dtype=float):
+    # Instantaneous rate in Mbps of a received power P_RX in dBm over a
+    # bandwidth B in Hz: B log2(1 + P_RX / noise_power).
+    P_RX = np.asarray(P_RX)
+    if out is None:
+        out = np.empty(np.broadcast_shapes(P_RX.shape, np.shape(B), np.shape(noise_power)), dtype=dtype)
+
+    np.divide(P_RX, 10., out=out)
+    np.power(10., out, out=out)
+    np.divide(out, noise_power, out=out)
+    np.add(1, out, out=out)
+    np.log2(out, out=out)
+    np.multiply(B, out, out=out)
+    np.divide(out, 1e6, out=out)
+
+    return out
+
+def bs_distance(lon, lat, height):
+    # Distance from every user to the base station.
+    return ((lon - BS_x) ** 2 + (lat - BS_y) ** 2 + (height - BS_z) ** 2) ** 0.5
+
+def beamwidth(My):
+    # 3 dB beamwidth approximation of a ULA of My antennas, in rad.
+    return 102 / np.asarray(My) * math.pi/180
+
+def beam_coherence_time(D, alpha, My, v_s, out=None, dtype=float):
+    # Beam coherence time in ms of users at distance D moving at v_s km/h
+    # with an angle of arrival alpha.
+    if out is None:
+        out = np.empty(np.broadcast_shapes(np.shape(D), np.shape(alpha), np.shape(My), np.shape(v_s)), dtype=dtype)
+
+    np.multiply(np.multiply(v_s, 1000) / 3600, np.sin(alpha), out=out)
+    np.divide(D, out, out=out)
+    np.multiply(out, beamwidth(My), out=out)
+    np.divide(out, 2., out=out)
+    np.multiply(out, 1e3, out=out)
+
+    return out
+
+def ofdm_coherence_time(alpha, freq, v_s, out=None, dtype=float):
+    # Channel (Doppler) coherence time in ms at carrier freq.
+    if out is None:
+        out = np.empty(np.broadcast_shapes(np.shape(alpha), np.shape(freq), np.shape(v_s)), dtype=dtype)
+
+    np.multiply(np.multiply(freq, v_s), np.sin(alpha), out=out)
+    np.multiply(out, 1000, out=out)
+    np.divide(out, 3600, out=out)
+    np.divide(c, out, out=out)
+    np.multiply(out, 1e3, out=out)
+
+    return out
+
+def coherence_time_surface(D, alpha, v_s, My, freq, q=1, chunk_elements=chunk_elements):
+    # q-th percentile of the coherence time in ms over the users, of shape
+    # (len(v_s), len(My), len(freq)), as in get_coherence_time.
+    v_s, My, freq = np.atleast_1d(v_s), np.atleast_1d(My), np.atleast_1d(freq)
+
+    # The beam coherence time only depends on (v_s, My), the OFDM one on (v_s, freq)
+    T_beam = _percentile_grid(lambda v, m: beam_coherence_time(D, alpha, m, v), v_s, My, q, len(D), chunk_elements)
+    T_ofdm = _percentile_grid(lambda v, f: ofdm_coherence_time(alpha, f, v), v_s, freq, q, len(D), chunk_elements)
+
+    return np.where(freq >= 28e9, T_beam[:,:,None], np.minimum(T_ofdm[:,None,:], T_beam[:,:,None]))
+
+def _percentile_grid(kernel, x, y, q, n_users, chunk_elements):
+    # q-th percentile over the users of kernel(x, y) for every point of the
+    # x by y grid, a chunk of grid points at a time.
+    xx, yy = [g.ravel() for g in np.meshgrid(x, y, indexing='ij')]
+    rows = max(1, chunk_elements // max(n_users, 1))
+
+    out = np.empty(len(xx))
+    for start in np.arange(0, len(xx), rows):
+        stop = min(start + rows, len(xx))
+        out[start:stop] = np.percentile(kernel(xx[start:stop,None], yy[start:stop,None]), q, axis=1)
+
+    return out.reshape(len(x), len(y))
+
+def beam_training_time(horiz_beams=32, vertical_beams=8, probes=None):
+    # Beam training penalty in ms of probing horiz_beams x vertical_beams
+    # beams, or the given probes per user of the hierarchical search.
+    if probes is not None:
+        return beam_time * np.mean(probes)
+
+    return beam_time * horiz_beams * vertical_beams
+
+def beam_training_penalties(probes_sub6=None, probes_mmWave=None):
+    # (sub6, mmWave) beam training penalties in ms, see beam_training_time.
+    if probes_sub6 is None:
+        penalty_sub6 = beam_training_time(*training_beams_sub6)
+    else:
+        penalty_sub6 = beam_training_time(probes=probes_sub6)
+
+    if probes_mmWave is None:
+        penalty_mmWave = beam_training_time(*training_beams_mmWave)
+    else:
+        penalty_mmWave = beam_training_time(probes=probes_mmWave)
+
+    return penalty_sub6, penalty_mmWave
+
+def effective_rate_coefficients(coherence_time, beam_training_penalty, gap_duration):
+    # Fraction of the coherence time left for data without and with a
+    # handover: returns (coeff_no_ho, coeff_ho).
+    coeff_no_ho = (coherence_time - beam_training_penalty) / coherence_time
+    coeff_ho = (coherence_time - beam_training_penalty - gap_duration) / coherence_time
+
+    return coeff_no_ho, coeff_ho
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo replicates of the non-learned policies over the random draws of
+a run: the exploitation users, their blockage and their source band.
+"""
+
+import os
+import time
+import math
+import numpy as np
+import pandas as pd
+
+from policies import evaluate_policies
+from blockage import draw_realization
+from sketches import accumulator, accumulate, kll_quantiles
+from results import append
+from sweep import defaults, out_dir, base_file, base_columns, seed, open_base, point_capacities, point_coefficients, point_request_handover_threshold
+
+chunk_elements = 2 ** 18 # replicates x users per chunk, small enough to stay in cache
+
+quantiles = [0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+policies = ['Optimal', 'Legacy', 'Blind', 'Sub-6 only', 'mmWave only']
+
+def draw_replicates(n_users, n_exploit, p_randomness, p_blockage_learning, p_blockage_exploitation, rng, n_replicates):
+    # (replicates, n_exploit) exploitation users, blockage and user masks.
+    p_b, p_b_exploit, user_mask, exploit_indices = draw_realization(n_users, n_exploit, p_randomness, p_blockage_learning,
+                                                                    p_blockage_exploitation, rng, n_replicates)
+
+    return (exploit_indices, np.take_along_axis(p_b_exploit, exploit_indices, axis=1) == 1,
+            np.take_along_axis(user_mask, exploit_indices, axis=1) == 1)
+
+def replicate_rates(capacity_35, capacity_28, capacity_28_blocked, exploit_indices, p_b, user_mask, request_handover_threshold,
+                    coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho):
+    # Effective rates {policy: (replicates, n_exploit)} of draw_replicates.
+    capacity_35 = capacity_35[exploit_indices]
+    capacity_28 = np.where(p_b, capacity_28_blocked[exploit_indices], capacity_28[exploit_indices])
+
+    # Source and Target are instantaneous rates.
+    source = np.where(user_mask, capacity_28, capacity_35)
+    target = np.where(user_mask, capacity_35, capacity_28)
+
+    rates = evaluate_policies(source, target, source == capacity_35, source == capacity_28, request_handover_threshold,
+                              coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+
+    return {'Optimal': rates['optimal']['Capacity'],
+            'Legacy': rates['legacy']['Capacity'],
+            'Blind': rates['blind']['Capacity'],
+            'Sub-6 only': capacity_35 * coeff_sub6_no_ho,
+            'mmWave only': capacity_28 * coeff_mmWave_no_ho}
+
+def replicate_statistics(capacity_35, capacity_28, capacity_28_blocked, request_handover_threshold,
+                         coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho,
+                         p_randomness, p_blockage_learning, p_blockage_exploitation, q_exploitation, n_replicates=1000,
+                         quantiles=quantiles, seed=0, chunk_elements=chunk_elements, accumulator=None):
+    # {policy: DataFrame} of the throughput quantiles and mean rate, one row
+    # per replicate; the rates are also streamed into accumulator if given.
+    start_time = time.time()
+
+    n_users = len(capacity_35)
+    n_exploit = int(q_exploitation * n_users)
+    seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    rows = max(1, chunk_elements // max(n_users, 1))
+    chunk_seeds = seed_sequence.spawn(-(-n_replicates // rows))
+
+    columns = ['q{}'.format(q) for q in quantiles] + ['mean']
+    statistics = {policy: np.empty((n_replicates, len(columns))) for policy in policies}
+    for chunk, start in enumerate(np.arange(0, n_replicates, rows)):
+        stop = min(start + rows, n_replicates)
+        draws = draw_replicates(n_users, n_exploit, p_randomness, p_blockage_learning, p_blockage_exploitation,
+                                np.random.default_rng(chunk_seeds[chunk]), stop - start)
+        rates = replicate_rates(capacity_35, capacity_28, capacity_28_blocked, *draws, request_handover_threshold,
+                                coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+
+        if accumulator is not None:
+            accumulate(accumulator, rates)
+
+        for policy in policies:
+            statistics[policy][start:stop,:-1] = sorted_quantiles(np.sort(rates[policy], axis=1), quantiles)
+            statistics[policy][start:stop,-1] = rates[policy].mean(axis=1)
+
+    elapsed = time.time() - start_time
+    print('INFO: {0} replicates of {1} exploitation users in {2:.2f} s.'.format(n_replicates, n_exploit, elapsed))
+
+    return {policy: pd.DataFrame(statistics[policy], columns=columns) for policy in policies}
+
+def sorted_quantiles(values, quantiles):
+    # np.quantile along the last axis of already sorted values.
+    position = np.asarray(quantiles) * (values.shape[-1] - 1)
+    below = np.floor(position).astype(int)
+    above = np.minimum(below + 1, values.shape[-1] - 1)
+    fraction = position - below
+
+    return values[...,below] + fraction * (values[...,above] - values[...,below])
+
+def confidence_bands(statistics, confidence=0.95):
+    # Mean and percentile confidence band over the replicates of every
+    # statistic of replicate_statistics, one row per (policy, statistic).
+    lower, upper = 100 * (1 - confidence) / 2, 100 * (1 + confidence) / 2
+
+    rows = []
+    for policy in statistics:
+        values = statistics[policy].values
+        band = np.nanpercentile(values, [lower, upper], axis=0)
+        for i, column in enumerate(statistics[policy].columns):
+            rows.append({'policy': policy, 'statistic': column, 'estimate': np.nanmean(values[:,i]),
+                         'lower': band[0,i], 'upper': band[1,i]})
+
+    return pd.DataFrame(rows)
+
+def run_replicates(params, n_replicates=1000, base_path=None, out_dir=out_dir, seed=seed, confidence=0.95, cdf_points=101):
+    # Replicates at one point of the grid of sweep.py; appends and returns
+    # replicate_bands, and appends the pooled CDF to replicate_cdf.
+    base = open_base(base_path or os.path.join(out_dir, base_file))
+    p = dict(defaults, **params)
+    alpha_seed, replicate_seed = np.random.SeedSequence(seed).spawn(2)
+
+    lon, lat, height, gain_35, gain_28_nb, gain_28_b = [base[:,i] for i in np.arange(len(base_columns))]
+    capacity_35, capacity_28, capacity_28_blocked = point_capacities(p, gain_35, gain_28_nb, gain_28_b)
+
+    alpha = np.random.default_rng(alpha_seed).uniform(0, math.pi, size=base.shape[0])
+    coeffs = point_coefficients(p, lon, lat, height, alpha)[2:]
+
+    pooled = accumulator(policies)
+    statistics = replicate_statistics(capacity_35, capacity_28, capacity_28_blocked, point_request_handover_threshold(p), *coeffs,
+                                      p['p_randomness'], p['p_blockage_learning'], p['p_blockage_exploitation'], p['q_exploitation'],
+                                      n_replicates=n_replicates, seed=replicate_seed, accumulator=pooled)
+    bands = confidence_bands(statistics, confidence)
+    append('replicate_bands', bands, root=out_dir, n_replicates=n_replicates, seed=seed, confidence=confidence, **params)
+
+    cdf = np.linspace(0, 1, cdf_points)
+    append('replicate_cdf', {'policy': np.repeat(policies, cdf_points), 'cdf': np.tile(cdf, len(policies)),
+                             'rate': np.concatenate([kll_quantiles(pooled['sketches'][policy], cdf) for policy in policies])},
+           root=out_dir, n_replicates=n_replicates, seed=seed, **params)
+
+    return bands
+
+if __name__ == '__main__':
+    os.chdir('/Users/farismismar/Desktop/DeepMIMO')
+
+    # Confidence bands of the reference point over 1000 replicates
+    run_replicates({'p_randomness': 0.3}, n_replicates=1000)
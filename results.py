@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar store of the experiment results of the main scripts and sweeps.
+
+A table is a directory of HDF5 part files, one per append:
+    <root>/<table>/part-<time>-<pid>-<random>.h5
+Each part holds one dataset per column and, as attributes, the run key it
+was appended with (p_randomness, blockage probabilities, r_training,
+backend, seed, ...).  Parts are written to a temporary name and moved into
+place, and never modified afterwards, so any number of processes can append
+to a table at once and a reader only ever sees complete parts.
+
+read() checks the key of every part from its attributes and only reads the
+columns of the parts that match, so selecting a few runs out of hundreds
+does not read the others.
+"""
+
+import os
+import glob
+import json
+import time
+import uuid
+import numpy as np
+import pandas as pd
+import h5py
+
+result_root = 'results'
+
+def append(table, data, root=result_root, **key):
+    # Appends the rows of data (a DataFrame or {column: values}) to table,
+    # tagged with the run key.  Key values must be scalars (numbers, strings
+    # or None).  Returns the path of the new part.
+    data = pd.DataFrame(data)
+    key = {name: (value.item() if isinstance(value, np.generic) else value) for name, value in key.items()}
+
+    path = os.path.join(root, table)
+    os.makedirs(path, exist_ok=True)
+    name = 'part-{0:.6f}-{1}-{2}.h5'.format(time.time(), os.getpid(), uuid.uuid4().hex[:8])
+
+    tmp = os.path.join(path, '.' + name + '.tmp')
+    with h5py.File(tmp, 'w') as f:
+        f.attrs['key'] = json.dumps(key, sort_keys=True)
+        f.attrs['columns'] = json.dumps([str(column) for column in data.columns])
+        f.attrs['rows'] = data.shape[0]
+        for column in data.columns:
+            values = data[column].values
+            if values.dtype.kind in 'OUS' or isinstance(data[column].dtype, pd.StringDtype):
+                values = np.array(data[column].astype(str).values, dtype=h5py.string_dtype())
+            f.create_dataset(str(column), data=values, compression='gzip' if len(values) > 1024 else None)
+    os.replace(tmp, os.path.join(path, name))
+
+    return os.path.join(path, name)
+
+def runs(table, root=result_root):
+    # One row per part of the table: its run key, number of rows and file.
+    rows = []
+    for part in _parts(table, root):
+        with h5py.File(part, 'r') as f:
+            rows.append(dict(json.loads(f.attrs['key']), rows=int(f.attrs['rows']), part=part))
+
+    return pd.DataFrame(rows)
+
+def read(table, root=result_root, columns=None, **where):
+    # Rows of table appended with a run key matching where, as one
+    # DataFrame with the key as extra columns.  A where value is either a
+    # value or a list of accepted values, e.g.
+    #     read('post', p_randomness=[0.3, 0.5], backend='fc_tf')
+    frames = []
+    for part in _parts(table, root):
+        with h5py.File(part, 'r') as f:
+            key = json.loads(f.attrs['key'])
+            if not _matches(key, where):
+                continue
+
+            names = json.loads(f.attrs['columns']) if columns is None else [column for column in columns if column in f]
+            frame = pd.DataFrame({column: _read_column(f[column]) for column in names})
+            for name, value in key.items():
+                frame[name] = value
+            frames.append(frame)
+
+    if len(frames) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(frames, ignore_index=True)
+
+def _parts(table, root):
+    # Complete parts only; temporary files start with a dot.
+    return sorted(glob.glob(os.path.join(root, table, 'part-*.h5')))
+
+def _matches(key, where):
+    for name, accepted in where.items():
+        if not isinstance(accepted, (list, tuple, set, np.ndarray)):
+            accepted = [accepted]
+        if key.get(name) not in list(accepted):
+            return False
+
+    return True
+
+def _read_column(dataset):
+    if h5py.check_string_dtype(dataset.dtype) is not None:
+        return dataset.asstr()[()]
+
+    return dataset[()]
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mergeable accumulators of throughput distributions: KLL quantile sketches
+(Karnin, Lang and Liberty, 2016) and fixed-bin 2-D histograms.
+"""
+
+import numpy as np
+
+k = 200 # items of the top level of a sketch
+chunk_size = 2 ** 20 # values per update of accumulate
+
+def kll_sketch(k=k, seed=0):
+    return {'k': k, 'seed': seed, 'compactions': 0, 'n': 0, 'min': np.inf, 'max': -np.inf,
+            'levels': [np.empty(0)]}
+
+def kll_update(sketch, values):
+    # Adds values (NaN are dropped) to the sketch, in place; returns it.
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return sketch
+
+    sketch['n'] += len(values)
+    sketch['min'] = min(sketch['min'], values.min())
+    sketch['max'] = max(sketch['max'], values.max())
+    sketch['levels'][0] = np.concatenate([sketch['levels'][0], values])
+
+    return _compress(sketch)
+
+def kll_merge(sketch, other):
+    # Adds the values of other, a sketch of the same k, to sketch in place;
+    # returns it.
+    if sketch['k'] != other['k']:
+        raise ValueError('Cannot merge sketches of k = {0} and k = {1}.'.format(sketch['k'], other['k']))
+
+    sketch['n'] += other['n']
+    sketch['min'] = min(sketch['min'], other['min'])
+    sketch['max'] = max(sketch['max'], other['max'])
+    for h, level in enumerate(other['levels']):
+        if h == len(sketch['levels']):
+            sketch['levels'].append(np.empty(0))
+        sketch['levels'][h] = np.concatenate([sketch['levels'][h], level])
+
+    return _compress(sketch)
+
+def kll_quantiles(sketch, quantiles):
+    # Approximate quantiles of the values of the sketch (NaN when empty).
+    items, cumulative = _sorted_items(sketch)
+    quantiles = np.asarray(quantiles, dtype=float)
+    if len(items) == 0:
+        return np.full(quantiles.shape, np.nan)
+
+    index = np.searchsorted(cumulative, quantiles * sketch['n'], side='left')
+    values = items[np.clip(index, 0, len(items) - 1)]
+
+    # The extremes are known exactly
+    values = np.where(quantiles <= 0, sketch['min'], values)
+    return np.where(quantiles >= 1, sketch['max'], values)
+
+def kll_cdf(sketch, x):
+    # Approximate fraction of the values of the sketch at or below x.
+    items, cumulative = _sorted_items(sketch)
+    if len(items) == 0:
+        return np.full(np.shape(x), np.nan)
+
+    index = np.searchsorted(items, x, side='right')
+    return np.concatenate([[0], cumulative])[index] / sketch['n']
+
+def _capacity(sketch, h):
+    return max(2, int(np.ceil(sketch['k'] * (2. / 3) ** (len(sketch['levels']) - 1 - h))))
+
+def _compress(sketch):
+    # Compacts every level over its capacity, from the bottom up.
+    levels = sketch['levels']
+    h = 0
+    while h < len(levels):
+        if len(levels[h]) > _capacity(sketch, h):
+            if h + 1 == len(levels):
+                levels.append(np.empty(0))
+
+            # An odd item out stays; of the sorted pairs, one in two moves up.
+            level = np.sort(levels[h])
+            odd = len(level) % 2
+            offset = np.random.default_rng([sketch['seed'], sketch['compactions']]).integers(0, 2)
+            sketch['compactions'] += 1
+
+            levels[h + 1] = np.concatenate([levels[h + 1], level[odd + offset::2]])
+            levels[h] = level[:odd]
+        h += 1
+
+    return sketch
+
+def _sorted_items(sketch):
+    # Items of all levels in increasing order and their cumulative weights.
+    items = np.concatenate(sketch['levels'])
+    weights = np.concatenate([np.full(len(level), 2. ** h) for h, level in enumerate(sketch['levels'])])
+    order = np.argsort(items, kind='stable')
+
+    return items[order], np.cumsum(weights[order])
+
+def histogram2d_accumulator(x_edges, y_edges):
+    x_edges, y_edges = np.asarray(x_edges, dtype=float), np.asarray(y_edges, dtype=float)
+    return {'x_edges': x_edges, 'y_edges': y_edges, 'counts': np.zeros((len(x_edges) - 1, len(y_edges) - 1))}
+
+def histogram2d_update(histogram, x, y):
+    # Adds the pairs (x, y) to the histogram in place; values outside the
+    # edges go to the edge bins.  Pairs with a NaN are dropped.
+    x, y = np.asarray(x, dtype=float).ravel(), np.asarray(y, dtype=float).ravel()
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x = np.clip(x[valid], histogram['x_edges'][0], histogram['x_edges'][-1])
+    y = np.clip(y[valid], histogram['y_edges'][0], histogram['y_edges'][-1])
+
+    histogram['counts'] += np.histogram2d(x, y, bins=(histogram['x_edges'], histogram['y_edges']))[0]
+    return histogram
+
+def histogram2d_merge(histogram, other):
+    if not (np.array_equal(histogram['x_edges'], other['x_edges']) and np.array_equal(histogram['y_edges'], other['y_edges'])):
+        raise ValueError('Cannot merge histograms with different bin edges.')
+
+    histogram['counts'] += other['counts']
+    return histogram
+
+def histogram2d_cdf(histogram):
+    # The joint CDF of the scripts' plot_joint_cdf at the upper bin edges.
+    counts = histogram['counts']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pdf = counts / counts.sum(axis=1, keepdims=True) / counts.shape[0]
+
+    return pdf.cumsum(axis=0).cumsum(axis=1)
+
+def accumulator(columns, k=k, joint=None, seed=0):
+    # One sketch per column and a 2-D histogram per joint name:
+    # (x_column, y_column, x_edges, y_edges).
+    joint = joint or {}
+    return {'sketches': {column: kll_sketch(k, seed=seed + i) for i, column in enumerate(columns)},
+            'joint': {name: (x, y, histogram2d_accumulator(x_edges, y_edges)) for name, (x, y, x_edges, y_edges) in joint.items()}}
+
+def accumulate(acc, rates, chunk_size=chunk_size):
+    # Streams rates ({column: values}) into acc, chunk_size values at a time.
+    for column, sketch in acc['sketches'].items():
+        values = np.asarray(rates[column]).ravel()
+        for start in np.arange(0, len(values), chunk_size):
+            kll_update(sketch, values[start:start + chunk_size])
+
+    for x, y, histogram in acc['joint'].values():
+        x_values, y_values = np.asarray(rates[x]).ravel(), np.asarray(rates[y]).ravel()
+        for start in np.arange(0, len(x_values), chunk_size):
+            histogram2d_update(histogram, x_values[start:start + chunk_size], y_values[start:start + chunk_size])
+
+    return acc
+
+def merge_accumulators(acc, other):
+    # Merges other, e.g. the accumulator of another worker, into acc.
+    for column, sketch in other['sketches'].items():
+        kll_merge(acc['sketches'][column], sketch)
+    for name, (_, _, histogram) in other['joint'].items():
+        histogram2d_merge(acc['joint'][name][2], histogram)
+
+    return acc
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parallel parameter sweep of the rate and handover post-processing of the
+main scripts over p_randomness, the blockage probabilities, gap_fraction
+and the mmWave bandwidth multiplier.
+
+The base data (user locations and the beamforming gains of every variant)
+is built once from the gain cache into <out_dir>/base.npy; every worker
+maps it read-only once, so it is never reloaded or pickled per point.
+Point i draws from its own child of SeedSequence(seed), so a point gives
+the same output whether it runs alone, sequentially or on any number of
+processes.  Each point appends to two tables of the result store in
+<out_dir> (results.py), keyed by its parameters, index, seed and spawn key:
+    sweep_rates   -- effective rates of every policy on the exploitation users
+    sweep_summary -- one row of mean rates, handover counts and coherence times
+so comparing points is one read(), e.g.
+    read('sweep_summary', root=out_dir, p_randomness=[0.3, 0.5])
+Every point also streams its rates into an accumulator (sketches.py); the
+workers' accumulators are merged into the distribution pooled over the grid:
+    sweep_cdf     -- cdf_points rates of the pooled CDF of every policy
+    sweep_joint   -- pooled joint histogram of Sub-6 only and mmWave only
+
+The classifier is not part of the sweep: the proposed policy grants the
+handovers with the true label y, as the effective rates of the scripts do.
+"""
+
+import os
+import time
+import shutil
+import math
+import itertools
+import numpy as np
+import pandas as pd
+from multiprocessing import Pool
+
+from channel_store import open_loc
+from gain_cache import cached_variant_beams
+from beamforming import hierarchical_probes
+from blockage import draw_realization, apply_blockage
+from rates import noise_power, shannon_rate, bs_distance, coherence_time_surface, effective_rate_coefficients, beam_training_penalties
+from policies import evaluate_policies
+from results import append, read
+from sketches import accumulator, accumulate, merge_accumulators, kll_quantiles
+
+store_root = 'dataset'
+out_dir = 'figures/sweep'
+base_file = 'base.npy'
+base_columns = ['lon', 'lat', 'height', 'gain_35', 'gain_28', 'gain_28_blockage']
+
+max_users = 54481
+n_workers = 4
+seed = 0
+
+# Beam sweep parameters of the scripts, so the base data reads their gain
+# cache entry instead of computing one of its own
+top_k = 4
+precision = 'double'
+last_codeword = True
+
+# Same codebooks as create_datasets
+codebooks = {'3.5_GHz': (8, 4, 3.5e9),
+             '28_GHz': (64, 4, 28e9),
+             '28_GHz_blockage': (64, 4, 28e9)}
+
+# Fixed parameters of the scripts; a grid entry overrides any of them
+defaults = {'p_randomness': 0.3, 'p_blockage_learning': 0.4, 'p_blockage_exploitation': 0.2,
+            'gap_fraction': 0.6, 'mmWave_BW_multiplier': 10, 'q_exploitation': 0.8,
+            'rate_threshold_sub6': 1.72, 'rate_threshold_mmWave': 7.00, 'request_handover_threshold': None,
+            'PTX_35': 1, 'PTX_28': 1, 'v_s': 50, 'delta_f_35': 180e3, 'delta_f_28': 180e3,
+            'N_SC_35': 1, 'N_SC_28': 1, 'Nf': 7, 'T': 290,
+            'hierarchical_beam_search': False}
+
+# Pooled distributions of run_sweep: the policies' CDFs at cdf_points
+# probabilities, and the joint histogram of the Sub-6 only and mmWave only
+# rates on the edges (in Mbps) of plot_joint_cdf's axes; rates past the
+# edges count in the edge bins.
+rate_columns = ['Optimal', 'Proposed', 'Legacy', 'Blind', 'Sub-6 only', 'mmWave only']
+cdf_points = 101
+joint_edges = (np.linspace(0, 4, 101), np.linspace(0, 20, 101))
+
+sweep_tables = ['sweep_rates', 'sweep_summary', 'sweep_cdf', 'sweep_joint']
+
+_base = None # the base data, mapped once per worker
+
+def build_base(root=store_root, out_dir=out_dir, n_users=max_users, top_k=top_k, precision=precision, n_workers=n_workers, last_codeword=last_codeword):
+    # Writes the locations and the beamforming gains of every variant to
+    # <out_dir>/base.npy, a (users, len(base_columns)) float64 array.
+    beams = cached_variant_beams(root, codebooks, n_users, top_k=top_k, precision=precision, n_workers=n_workers, last_codeword=last_codeword)
+    gains = {variant: beams[variant][0] for variant in codebooks}
+    loc = open_loc(root)
+    n = min(n_users, loc.shape[0])
+
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, base_file)
+    base = np.lib.format.open_memmap(path, mode='w+', dtype=float, shape=(n, len(base_columns)))
+    base[:,:3] = loc[:n,:]
+    base[:,3] = gains['3.5_GHz']
+    base[:,4] = gains['28_GHz']
+    base[:,5] = gains['28_GHz_blockage']
+    base.flush()
+    del base
+
+    return path
+
+def expand_grid(grid):
+    # {parameter: [values]} -> list of {parameter: value}, one per point.
+    # NumPy values become Python ones, so the points can be written to JSON.
+    names = sorted(grid)
+    values = [[v.item() if isinstance(v, np.generic) else v for v in grid[name]] for name in names]
+    return [dict(zip(names, point)) for point in itertools.product(*values)]
+
+def open_base(base_path):
+    # The base data of build_base, memory mapped read-only.
+    return np.load(base_path, mmap_mode='r')
+
+def _init_worker(base_path):
+    global _base
+    _base = open_base(base_path)
+
+def run_point(args):
+    # Rates and policies of one point of the grid; returns (index, seconds,
+    # accumulator of the rates).
+    index, params, seed_sequence, out_dir = args
+    start_time = time.time()
+
+    p = dict(defaults, **params)
+    rng = np.random.default_rng(seed_sequence)
+
+    lon, lat, height, gain_35, gain_28_nb, gain_28_b = [_base[:,i] for i in np.arange(len(base_columns))]
+    n = _base.shape[0]
+
+    # Blockage of the learning and exploitation phases, the users' bands
+    # (0 == user is 3.5, 1 == user is mmWave) and the exploitation users
+    p_b, p_b_exploit, user_mask, exploit_indices = draw_realization(n, int(p['q_exploitation'] * n), p['p_randomness'],
+                                                                    p['p_blockage_learning'], p['p_blockage_exploitation'], rng)
+    gain_28 = apply_blockage(gain_28_b, gain_28_nb, p_b)
+    gain_28_exploit = apply_blockage(gain_28_b, gain_28_nb, p_b_exploit)
+
+    # Instantaneous rates (Shannon)
+    capacity_35, capacity_28, capacity_28_exploit = point_capacities(p, gain_35, gain_28, gain_28_exploit)
+
+    capacity_28[exploit_indices] = capacity_28_exploit[exploit_indices]
+
+    # Source and Target are instantaneous rates.
+    source = np.where(user_mask == 0, capacity_35, capacity_28)
+    target = np.where(user_mask == 0, capacity_28, capacity_35)
+
+    # Effective achievable rates; one alpha for both bands
+    alpha = rng.uniform(0, math.pi, size=n)
+    coherence_time_sub6, coherence_time_mmWave, coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho = point_coefficients(p, lon, lat, height, alpha)
+    request_handover_threshold = point_request_handover_threshold(p)
+
+    policy_rates = evaluate_policies(source, target, source == capacity_35, source == capacity_28, request_handover_threshold,
+                                     coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho)
+
+    data = pd.DataFrame({'Optimal': policy_rates['optimal']['Capacity'][exploit_indices],
+                         'Proposed': policy_rates['proposed']['Capacity'][exploit_indices],
+                         'HO_requested': policy_rates['proposed']['HO_requested'][exploit_indices],
+                         'Legacy': policy_rates['legacy']['Capacity'][exploit_indices],
+                         'Blind': policy_rates['blind']['Capacity'][exploit_indices],
+                         'Sub-6 only': capacity_35[exploit_indices] * coeff_sub6_no_ho,
+                         'mmWave only': capacity_28_exploit[exploit_indices] * coeff_mmWave_no_ho})
+
+    # Point i is the child i of SeedSequence(seed): SeedSequence(seed,
+    # spawn_key=...) with the stored spawn_key gives its generator back
+    key = dict(params, point=index, seed=seed_sequence.entropy, spawn_key='/'.join(str(k) for k in seed_sequence.spawn_key))
+    append('sweep_rates', data, root=out_dir, **key)
+
+    summary = {'request_handover_threshold': [request_handover_threshold],
+               'coherence_time_sub6': [coherence_time_sub6], 'coherence_time_mmWave': [coherence_time_mmWave]}
+    for column in rate_columns:
+        summary[column] = [data[column].mean()]
+    for policy in ['legacy', 'blind', 'proposed']:
+        summary['HO_requested_{}'.format(policy)] = [policy_rates[policy]['HO_requested'][exploit_indices].sum()]
+        summary['HO_granted_{}'.format(policy)] = [(policy_rates[policy]['HO_requested'] * policy_rates[policy]['y'])[exploit_indices].sum()]
+    append('sweep_summary', summary, root=out_dir, **key)
+
+    acc = accumulator(rate_columns, joint={'sub6_mmWave': ('Sub-6 only', 'mmWave only') + joint_edges},
+                      seed=int(seed_sequence.generate_state(1)[0]))
+    accumulate(acc, data)
+
+    return index, time.time() - start_time, acc
+
+def point_capacities(p, gain_35, *gains_28):
+    # Instantaneous rates of the 3.5 GHz gains and of every 28 GHz gains.
+    B_35 = p['N_SC_35'] * p['delta_f_35']
+    B_28 = p['N_SC_28'] * p['delta_f_28'] * p['mmWave_BW_multiplier']
+    noise_power_35 = noise_power(p['delta_f_35'], p['Nf'], p['T'])
+    noise_power_28 = noise_power(p['delta_f_28'], p['Nf'], p['T'], p['mmWave_BW_multiplier'])
+
+    capacities = [shannon_rate(10*np.log10(p['PTX_35'] * 1e3 * gain_35), B_35, noise_power_35)]
+    for gain_28 in gains_28:
+        capacities.append(shannon_rate(10*np.log10(p['PTX_28'] * 1e3 * gain_28), B_28, noise_power_28))
+
+    return capacities
+
+def point_coefficients(p, lon, lat, height, alpha):
+    # Coherence times and effective rate coefficients of both bands:
+    # (coherence_time_sub6, coherence_time_mmWave, coeff_sub6_no_ho,
+    #  coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho).
+    D = bs_distance(lon, lat, height)
+    T = coherence_time_surface(D, alpha, p['v_s'], [8, 64], [3.5e9, 28e9])
+    coherence_time_sub6, coherence_time_mmWave = T[0,0,0], T[0,1,1]
+
+    # The probes of the hierarchical search are the same for every user,
+    # so they are counted rather than searched for
+    if p['hierarchical_beam_search']:
+        beam_training_penalty_sub6, beam_training_penalty_mmWave = beam_training_penalties(hierarchical_probes(*codebooks['3.5_GHz'][:2]), hierarchical_probes(*codebooks['28_GHz'][:2]))
+    else:
+        beam_training_penalty_sub6, beam_training_penalty_mmWave = beam_training_penalties()
+    coeff_sub6_no_ho, coeff_sub6_ho = effective_rate_coefficients(coherence_time_sub6, beam_training_penalty_sub6, p['gap_fraction'] * coherence_time_sub6)
+    coeff_mmWave_no_ho, coeff_mmWave_ho = effective_rate_coefficients(coherence_time_mmWave, beam_training_penalty_mmWave, p['gap_fraction'] * coherence_time_mmWave)
+
+    return coherence_time_sub6, coherence_time_mmWave, coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho
+
+def point_request_handover_threshold(p):
+    if p['request_handover_threshold'] is None:
+        return (1 - p['p_randomness']) * p['rate_threshold_sub6'] + p['p_randomness'] * p['rate_threshold_mmWave']
+
+    return p['request_handover_threshold']
+
+def run_sweep(grid, out_dir=out_dir, base_path=None, n_workers=n_workers, seed=seed, benchmark=False, overwrite=False):
+    # Runs every point of the grid {parameter: [values]} on n_workers
+    # processes and returns a table of the points and their mean rates.
+    # base_path defaults to <out_dir>/base.npy, built by build_base.  The
+    # sweep tables of a previous sweep in out_dir are only replaced with
+    # overwrite=True; otherwise they raise FileExistsError.  The
+    # accumulators of the points are merged in point order, so the pooled
+    # tables do not depend on the number of processes.
+    # With benchmark=True the points are first run sequentially in this
+    # process, and the speedup of the process pool is reported.
+    base_path = base_path or os.path.join(out_dir, base_file)
+    points = expand_grid(grid)
+    seeds = np.random.SeedSequence(seed).spawn(len(points))
+    jobs = [(i, points[i], seeds[i], out_dir) for i in range(len(points))]
+
+    existing = [table for table in sweep_tables if os.path.exists(os.path.join(out_dir, table))]
+    if len(existing) > 0 and not overwrite:
+        raise FileExistsError('{0} already holds the sweep tables {1}; pass overwrite=True to replace them.'.format(out_dir, ', '.join(existing)))
+
+    if benchmark:
+        _clear_sweep(out_dir)
+        start_time = time.time()
+        _init_worker(base_path)
+        list(map(run_point, jobs))
+        sequential = time.time() - start_time
+        print('INFO: sequential sweep of {0} points in {1:.2f} s.'.format(len(points), sequential))
+
+    _clear_sweep(out_dir)
+    start_time = time.time()
+    if n_workers <= 1:
+        _init_worker(base_path)
+        results = list(map(run_point, jobs))
+    else:
+        with Pool(processes=n_workers, initializer=_init_worker, initargs=(base_path,)) as pool:
+            results = list(pool.imap_unordered(run_point, jobs))
+    elapsed = time.time() - start_time
+
+    results.sort(key=lambda result: result[0])
+    pooled = results[0][2]
+    for result in results[1:]:
+        merge_accumulators(pooled, result[2])
+
+    cdf = np.linspace(0, 1, cdf_points)
+    append('sweep_cdf', {'policy': np.repeat(rate_columns, cdf_points), 'cdf': np.tile(cdf, len(rate_columns)),
+                         'rate': np.concatenate([kll_quantiles(pooled['sketches'][column], cdf) for column in rate_columns])},
+           root=out_dir, seed=seed, points=len(points))
+
+    histogram = pooled['joint']['sub6_mmWave'][2]
+    x_bin, y_bin = np.meshgrid(np.arange(histogram['counts'].shape[0]), np.arange(histogram['counts'].shape[1]), indexing='ij')
+    append('sweep_joint', {'x_low': histogram['x_edges'][x_bin.ravel()], 'x_high': histogram['x_edges'][x_bin.ravel() + 1],
+                           'y_low': histogram['y_edges'][y_bin.ravel()], 'y_high': histogram['y_edges'][y_bin.ravel() + 1],
+                           'count': histogram['counts'].ravel()},
+           root=out_dir, seed=seed, points=len(points))
+
+    print('INFO: sweep of {0} points on {1} process(es) in {2:.2f} s ({3:.2f} s per point).'.format(len(points), max(n_workers, 1), elapsed, elapsed / max(len(points), 1)))
+    if benchmark:
+        print('INFO: speedup against the sequential sweep: {0:.2f}x.'.format(sequential / max(elapsed, 1e-9)))
+
+    return read_sweep(out_dir)
+
+def read_sweep(out_dir=out_dir, **where):
+    # One row per point matching where (see results.read): its parameters,
+    # mean rates and handover counts, in the order of the points.
+    summary = read('sweep_summary', root=out_dir, **where)
+    if summary.shape[0] == 0:
+        return summary
+
+    return summary.sort_values('point', kind='stable').reset_index(drop=True)
+
+def read_joint(out_dir=out_dir):
+    # The pooled joint histogram of run_sweep, for the scripts' plot_joint_cdf.
+    joint = read('sweep_joint', root=out_dir).sort_values(['x_low', 'y_low'], kind='stable')
+    x_edges = np.append(np.unique(joint['x_low'].values), joint['x_high'].max())
+    y_edges = np.append(np.unique(joint['y_low'].values), joint['y_high'].max())
+
+    return {'x_edges': x_edges, 'y_edges': y_edges, 'counts': joint['count'].values.reshape(len(x_edges) - 1, len(y_edges) - 1)}
+
+def _clear_sweep(out_dir):
+    for table in sweep_tables:
+        shutil.rmtree(os.path.join(out_dir, table), ignore_errors=True)
+
+if __name__ == '__main__':
+    os.chdir('/Users/farismismar/Desktop/DeepMIMO')
+    grid = {'p_randomness': [0, 0.3, 0.5, 0.7, 1],
+            'p_blockage_exploitation': [0.2, 0.4, 0.6],
+            'gap_fraction': [0.2, 0.6],
+            'mmWave_BW_multiplier': [5, 10]}
+
+    build_base()
+    results = run_sweep(grid, benchmark=True, overwrite=True)
+    results.to_csv(os.path.join(out_dir, 'sweep.csv'), index=False)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks of the numerical kernels against brute-force references; run with
+python -m pytest -q.
+"""
+
+import numpy as np
+
+from beamforming import compute_optimal_gains, compute_optimal_beams, compute_optimal_gain_bf_vector, compute_bf_codebook, compute_dft_codebook, compute_hierarchical_beams, hierarchical_probes
+from bootstrap import resample_counts, resample_quantiles
+from sketches import kll_sketch, kll_update, kll_merge, kll_quantiles
+from policies import evaluate_policies, threshold_sweep
+from replicates import sorted_quantiles
+
+coeffs = (0.9, 0.8, 0.7, 0.6) # coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho
+
+def random_channels(n_users, n_antennas, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(n_users, n_antennas)) + 1j * rng.normal(size=(n_users, n_antennas))
+
+def brute_gains(H, F):
+    # |h^H f|^2 of every user and codeword, one vdot at a time.
+    return np.array([[abs(np.vdot(h, F[:,j])) ** 2 for j in np.arange(F.shape[1])] for h in H])
+
+def test_fft_search_matches_dense_search():
+    My, Mz, k_oversampling = 4, 2, 2
+    H = random_channels(50, My * Mz)
+    F = compute_dft_codebook(My, Mz, k_oversampling)
+    G = brute_gains(H, F)
+
+    gains = compute_optimal_gains(H, F, My=My, Mz=Mz, k_oversampling=k_oversampling, last_codeword=False)
+    _, top_beams, top_gains = compute_optimal_beams(H, F, top_k=3, My=My, Mz=Mz, k_oversampling=k_oversampling, last_codeword=False)
+
+    assert np.allclose(gains, G.max(axis=1))
+    assert np.array_equal(top_beams[:,0], G.argmax(axis=1))
+    assert np.allclose(top_gains, -np.sort(-G, axis=1)[:,:3], rtol=1e-6)
+
+def test_non_dft_codebook_falls_back_to_dense_search():
+    My, Mz, k_oversampling = 4, 2, 2
+    H = random_channels(50, My * Mz)
+    F = compute_bf_codebook(My, Mz, 28e9, k_oversampling)
+
+    gains = compute_optimal_gains(H, F, My=My, Mz=Mz, k_oversampling=k_oversampling, last_codeword=False)
+
+    assert np.allclose(gains, [compute_optimal_gain_bf_vector(h, F, last_codeword=False) for h in H])
+
+def test_last_codeword_gains_match_per_user_loop():
+    H = random_channels(50, 8)
+    F = compute_bf_codebook(4, 2, 28e9, 2)
+
+    assert np.allclose(compute_optimal_gains(H, F, block_size=16), [compute_optimal_gain_bf_vector(h, F) for h in H])
+
+def test_hierarchical_search_probes_and_gains():
+    My, Mz, f_c, k_oversampling = 16, 2, 28e9, 2
+    H = random_channels(200, My * Mz)
+    F = compute_bf_codebook(My, Mz, f_c, k_oversampling)
+    G = brute_gains(H, F)
+
+    gains, beams, probes, gap_dB = compute_hierarchical_beams(H, My, Mz, f_c, k_oversampling, block_size=64, report=True)
+    assert np.all(probes == hierarchical_probes(My, Mz, k_oversampling))
+    assert np.allclose(gains, G[np.arange(len(H)), beams])
+    assert np.all(gains <= G.max(axis=1) * (1 + 1e-12))
+    assert np.allclose(gap_dB, 10*np.log10(G.max(axis=1) / gains))
+
+    # With every wide beam a candidate, all fine beams are probed
+    gains, beams, probes, _ = compute_hierarchical_beams(H, My, Mz, f_c, k_oversampling, n_candidates=My * Mz)
+    assert np.allclose(gains, G.max(axis=1))
+    assert np.all(probes == hierarchical_probes(My, Mz, k_oversampling, n_candidates=My * Mz))
+
+def test_resample_quantiles_match_gathered_resamples():
+    rng = np.random.default_rng(1)
+    sorted_values = np.sort(rng.exponential(size=1000))
+    quantiles = [0, 0.01, 0.25, 0.5, 0.9, 1]
+    counts = resample_counts(len(sorted_values), 20, rng)
+
+    assert np.all(counts.sum(axis=1) == len(sorted_values))
+    expected = [np.quantile(np.repeat(sorted_values, row), quantiles) for row in counts]
+    assert np.allclose(resample_quantiles(sorted_values, counts, quantiles, block=16), expected)
+
+def test_kll_quantiles_within_rank_error():
+    values = np.random.default_rng(2).normal(size=200000)
+    quantiles = np.linspace(0, 1, 21)
+
+    sketch = kll_update(kll_sketch(), values[:100000])
+    kll_merge(sketch, kll_update(kll_sketch(seed=1), values[100000:]))
+
+    assert sketch['n'] == len(values)
+    ranks = np.searchsorted(np.sort(values), kll_quantiles(sketch, quantiles), side='right') / len(values)
+    assert np.max(np.abs(ranks - quantiles)) < 0.02
+    assert kll_quantiles(sketch, [0])[0] == values.min() and kll_quantiles(sketch, [1])[0] == values.max()
+
+def test_threshold_sweep_matches_evaluate_policies():
+    rng = np.random.default_rng(3)
+    n = 500
+    source, target = rng.exponential(size=n), rng.exponential(size=n)
+    source_is_28 = rng.uniform(size=n) < 0.3
+    thresholds = np.concatenate([[0, 10], np.quantile(source, [0.1, 0.5, 0.9]), source[:2]])
+    y_pred = rng.integers(0, 2, size=(len(thresholds), n))
+
+    table = threshold_sweep(source, target, ~source_is_28, source_is_28, thresholds, *coeffs, y_pred=y_pred)
+    for i, x_hr in enumerate(thresholds):
+        rates = evaluate_policies(source, target, ~source_is_28, source_is_28, x_hr, *coeffs)
+        for policy in ['legacy', 'blind', 'proposed']:
+            assert table['HO_requested_{}'.format(policy)][i] == rates[policy]['HO_requested'].sum()
+            assert np.isclose(table['Capacity_{}'.format(policy.capitalize())][i], rates[policy]['Capacity'].mean())
+        assert table['HO_granted_legacy'][i] == rates['legacy']['y'].sum()
+        assert table['HO_granted_blind'][i] == rates['blind']['y'].sum()
+        assert table['HO_granted_proposed'][i] == (y_pred[i] * rates['proposed']['HO_requested']).sum()
+        assert np.isclose(table['Capacity_Optimal'][i], np.nanmean(rates['optimal']['Capacity']))
+
+def test_sorted_quantiles_match_numpy():
+    values = np.random.default_rng(4).normal(size=(7, 301))
+    quantiles = [0, 0.01, 0.33, 0.5, 0.99, 1]
+
+    assert np.allclose(sorted_quantiles(np.sort(values, axis=1), quantiles), np.quantile(values, quantiles, axis=1).T)
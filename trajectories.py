@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sequential handover simulator of UEs moving along the rows and columns of
+the DeepMIMO user grid.
+"""
+
+import os
+import time
+import math
+import numpy as np
+import pandas as pd
+
+from policies import effective_rate
+from blockage import apply_blockage
+from results import append
+from sweep import defaults, out_dir, base_file, base_columns, seed, open_base, point_capacities, point_coefficients, point_request_handover_threshold
+
+time_step = 10e-3 # s
+ping_pong_time = 1. # s; a handover back within this time is a ping-pong
+hysteresis_dB = 1.0 # Target / Source ratio of a handover request
+time_to_trigger = 160e-3 # s of run_trajectories
+
+def user_grid(lon, lat, decimals=2):
+    # (grid, spacing): grid[i, j] is the user at the i-th lat and j-th lon,
+    # -1 if none.  Raises ValueError if two users share a grid point.
+    lats, row = np.unique(np.round(lat, decimals), return_inverse=True)
+    lons, column = np.unique(np.round(lon, decimals), return_inverse=True)
+
+    collisions = len(lon) - len(np.unique(row * len(lons) + column))
+    if collisions > 0:
+        raise ValueError('{0} users share a grid point at {1} decimals; use more decimals.'.format(collisions, decimals))
+
+    grid = -np.ones((len(lats), len(lons)), dtype=np.int64)
+    grid[row, column] = np.arange(len(lon))
+
+    spacing = tuple(np.median(np.diff(axis)) if len(axis) > 1 else 1. for axis in [lats, lons])
+    return grid, spacing
+
+def grid_lines(grid, spacing):
+    # (lines, lengths, cell_size) of the rows and columns of the grid, holes
+    # filled with the nearest user.
+    rows, columns = _fill(grid), _fill(grid.T)
+    n = max(grid.shape)
+
+    lines = np.zeros((rows.shape[0] + columns.shape[0], n), dtype=np.int64)
+    lines[:rows.shape[0],:rows.shape[1]] = rows
+    lines[rows.shape[0]:,:columns.shape[1]] = columns
+    lengths = np.repeat([grid.shape[1], grid.shape[0]], [rows.shape[0], columns.shape[0]])
+    cell_size = np.repeat([spacing[1], spacing[0]], [rows.shape[0], columns.shape[0]])
+
+    keep = np.concatenate([(grid >= 0).any(axis=1), (grid >= 0).any(axis=0)]) & (lengths > 1)
+    return lines[keep], lengths[keep], cell_size[keep]
+
+def _fill(grid):
+    # Forward, then backward fill of the holes (-1) of every row.
+    index = np.where(grid >= 0, np.arange(grid.shape[1]), 0)
+    index = np.maximum.accumulate(index, axis=1)
+    filled = np.take_along_axis(grid, index, axis=1)
+
+    index = np.where(filled >= 0, np.arange(grid.shape[1]), grid.shape[1] - 1)[:,::-1]
+    index = np.minimum.accumulate(index, axis=1)[:,::-1]
+    return np.take_along_axis(filled, index, axis=1)
+
+def draw_trajectories(lengths, n_ues, rng=np.random):
+    # Line, start position (in cells) and direction of every UE.
+    line = rng.choice(len(lengths), size=n_ues)
+    start = rng.uniform(0, lengths[line] - 1)
+    direction = np.where(rng.uniform(size=n_ues) < 0.5, -1., 1.)
+
+    return line, start, direction
+
+def simulate(capacity_35, capacity_28, lines, lengths, cell_size, trajectories, serving_28, n_steps,
+             request_handover_threshold, hysteresis_dB, time_to_trigger,
+             coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho,
+             v_s=50, time_step=time_step, ping_pong_time=ping_pong_time):
+    # Steps the UEs n_steps times; returns one row per UE with its mean
+    # effective rate, handovers, ping-pongs and fraction of time on mmWave.
+    start_time = time.time()
+
+    line, start, direction = trajectories
+    n_ues = len(line)
+    length, period = lengths[line], 2 * (lengths[line] - 1)
+    cells_per_step = direction * (v_s * 1000 / 3600) * time_step / cell_size[line]
+    ttt_steps = max(1, int(np.ceil(time_to_trigger / time_step - 1e-9)))
+    ping_pong_steps = ping_pong_time / time_step
+    hysteresis = 10 ** (hysteresis_dB / 10.)
+
+    serving_28 = np.asarray(serving_28) == 1
+    timer = np.zeros(n_ues, dtype=np.int64)
+    last_handover = np.full(n_ues, -np.inf)
+    handovers = np.zeros(n_ues, dtype=np.int64)
+    ping_pongs = np.zeros(n_ues, dtype=np.int64)
+    mmWave_steps = np.zeros(n_ues, dtype=np.int64)
+    rate_sum = np.zeros(n_ues)
+
+    for step in np.arange(n_steps):
+        # Position on the line, bouncing back at its ends
+        position = np.mod(start + step * cells_per_step, period)
+        cell = np.rint(np.minimum(position, period - position)).astype(np.int64)
+        users = lines[line, np.minimum(cell, length - 1)]
+
+        rate_35, rate_28 = capacity_35[users], capacity_28[users]
+        source = np.where(serving_28, rate_28, rate_35)
+        target = np.where(serving_28, rate_35, rate_28)
+
+        requested = (source < request_handover_threshold) & (target > source * hysteresis)
+        timer = np.where(requested, timer + 1, 0)
+        executed = timer >= ttt_steps
+
+        rate_sum += effective_rate(source, target, ~serving_28, requested, executed,
+                                   coeff_sub6_no_ho, coeff_mmWave_no_ho, coeff_sub6_ho, coeff_mmWave_ho, gap=True)
+
+        # With two bands, any handover goes back to the band served before the last one
+        ping_pongs += executed & (step - last_handover <= ping_pong_steps)
+        handovers += executed
+        last_handover = np.where(executed, step, last_handover)
+        timer[executed] = 0
+        serving_28 ^= executed
+        mmWave_steps += serving_28
+
+    elapsed = time.time() - start_time
+    print('INFO: {0} UEs over {1} steps in {2:.2f} s ({3:.1f} million UE-steps/s).'.format(n_ues, n_steps, elapsed, n_ues * n_steps / max(elapsed, 1e-9) / 1e6))
+
+    return pd.DataFrame({'line': line, 'start': start, 'direction': direction,
+                         'Capacity': rate_sum / max(n_steps, 1), 'handovers': handovers, 'ping_pongs': ping_pongs,
+                         'mmWave_fraction': mmWave_steps / max(n_steps, 1)})
+
+def run_trajectories(params, n_ues=10000, duration=20., base_path=None, out_dir=out_dir, seed=seed):
+    # simulate at one point of the grid of sweep.py (params may also set
+    # hysteresis_dB and time_to_trigger); appends and returns the UE rows.
+    base = open_base(base_path or os.path.join(out_dir, base_file))
+    p = dict(defaults, hysteresis_dB=hysteresis_dB, time_to_trigger=time_to_trigger)
+    p.update(params)
+    rng = np.random.default_rng(seed)
+
+    lon, lat, height, gain_35, gain_28_nb, gain_28_b = [base[:,i] for i in np.arange(len(base_columns))]
+    n = base.shape[0]
+    p_b = rng.binomial(1, p['p_blockage_exploitation'], size=n)
+    capacity_35, capacity_28 = point_capacities(p, gain_35, apply_blockage(gain_28_b, gain_28_nb, p_b))
+
+    alpha = rng.uniform(0, math.pi, size=n)
+    coeffs = point_coefficients(p, lon, lat, height, alpha)[2:]
+
+    lines, lengths, cell_size = grid_lines(*user_grid(lon, lat))
+    trajectories = draw_trajectories(lengths, n_ues, rng)
+    serving_28 = rng.binomial(1, p['p_randomness'], size=n_ues)
+
+    ues = simulate(capacity_35, capacity_28, lines, lengths, cell_size, trajectories, serving_28, int(round(duration / time_step)),
+                   point_request_handover_threshold(p), p['hysteresis_dB'], p['time_to_trigger'], *coeffs, v_s=p['v_s'])
+    append('trajectories', ues, root=out_dir, n_ues=n_ues, duration=duration, seed=seed, **params)
+
+    return ues
+
+if __name__ == '__main__':
+    os.chdir('/Users/farismismar/Desktop/DeepMIMO')
+
+    # Handovers of moving UEs for a few times to trigger
+    for time_to_trigger in [0, 40e-3, 160e-3, 480e-3]:
+        run_trajectories({'p_randomness': 0.3, 'time_to_trigger': time_to_trigger})